@@ -84,6 +84,19 @@ resource "aws_dynamodb_table" "stations" {
     name = "station_id"
     type = "S"
   }
+
+  attribute {
+    name = "enabled_flag"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name               = "EnabledIndex"
+    hash_key           = "enabled_flag"
+    range_key          = "station_id"
+    projection_type    = "INCLUDE"
+    non_key_attributes = ["owner_id", "notify_on", "cooldown_minutes", "alerts_enabled"]
+  }
 }
 
 resource "aws_dynamodb_table" "owners" {
@@ -168,11 +181,12 @@ resource "aws_iam_role_policy" "collector_policy" {
       },
       {
         Effect = "Allow"
-        Action = ["dynamodb:BatchWriteItem", "dynamodb:PutItem", "dynamodb:Scan"]
+        Action = ["dynamodb:BatchWriteItem", "dynamodb:PutItem", "dynamodb:UpdateItem", "dynamodb:Query", "dynamodb:Scan"]
         Resource = [
           aws_dynamodb_table.metars.arn,
           aws_dynamodb_table.runs.arn,
-          aws_dynamodb_table.stations.arn
+          aws_dynamodb_table.stations.arn,
+          "${aws_dynamodb_table.stations.arn}/index/EnabledIndex"
         ]
       },
       {
@@ -206,6 +220,7 @@ resource "aws_lambda_function" "collector" {
       STALE_THRESHOLD_HOURS = tostring(var.stale_threshold_hours)
       ROUTER_EVENT_BUS     = "default"
       ALERT_ON_EMPTY       = tostring(var.alert_on_empty)
+      STATION_INDEX_READY  = tostring(var.station_index_ready)
     }
   }
 }
@@ -491,7 +506,7 @@ resource "aws_iam_role_policy" "router_policy" {
       },
       {
         Effect = "Allow"
-        Action = ["dynamodb:GetItem", "dynamodb:PutItem"]
+        Action = ["dynamodb:GetItem", "dynamodb:PutItem", "dynamodb:DeleteItem"]
         Resource = [
           aws_dynamodb_table.stations.arn,
           aws_dynamodb_table.owners.arn,
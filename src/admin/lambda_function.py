@@ -6,43 +6,78 @@ import os
 import secrets
 import time
 from decimal import Decimal
+from functools import lru_cache
+from operator import itemgetter
 
 import boto3
-
-dynamodb = boto3.resource("dynamodb")
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+dynamodb = boto3.resource(
+    "dynamodb",
+    config=Config(
+        tcp_keepalive=True,
+        max_pool_connections=10,
+        retries={"mode": "standard", "max_attempts": 3},
+    ),
+)
+
+LIST_CACHE_TTL_SECONDS = 30.0
+_list_cache: dict[str, tuple[float, list[dict]]] = {}
+# "scrypt" selects hashlib.scrypt; password_iterations then stores its cost N.
+PASSWORD_DIGESTS = frozenset(("sha256", "sha512", "scrypt"))
+SCRYPT_BLOCK_SIZE = 8
+SCRYPT_MAX_COST = 2**20
+BOOTSTRAP_SENTINEL = "__bootstrap_sentinel__"
+RESET_UPDATE_EXPRESSION = "SET reset_hash=:h, reset_salt=:s, reset_expires_epoch=:e, updated_at_epoch=:u"
+CONFIRM_UPDATE_EXPRESSION = (
+    "SET password_hash=:h, password_salt=:s, password_iterations=:i, "
+    "password_digest=:d, updated_at_epoch=:u "
+    "REMOVE reset_hash, reset_salt, reset_iterations, reset_expires_epoch"
+)
+CONFIRM_CONDITION_EXPRESSION = "reset_hash = :rh AND reset_expires_epoch >= :u"
+# Unpadded base64url of a SHA-256 digest is always 43 characters.
+TOKEN_SIG_LENGTH = 43
+TOKEN_PAYLOAD_MAX_LENGTH = 512
+VERIFY_CACHE_MAX_ENTRIES = 256
+_verify_cache: dict[str, tuple[str, int]] = {}
+RESPONSE_HEADERS = {
+    "Content-Type": "application/json",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET,POST,DELETE,OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type,Authorization",
+}
+
+
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, Decimal):
+            return int(o) if o % 1 == 0 else float(o)
+        return super().default(o)
+
+
+JSON_ENCODER = DecimalEncoder(separators=(",", ":"))
 
 
 def response(status_code: int, payload: dict) -> dict:
     return {
         "statusCode": status_code,
-        "headers": {
-            "Content-Type": "application/json",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "GET,POST,DELETE,OPTIONS",
-            "Access-Control-Allow-Headers": "Content-Type,Authorization",
-        },
-        "body": json.dumps(to_json_safe(payload)),
+        "headers": RESPONSE_HEADERS,
+        "body": JSON_ENCODER.encode(payload),
     }
 
 
-def to_json_safe(value):
-    if isinstance(value, list):
-        return [to_json_safe(v) for v in value]
-    if isinstance(value, dict):
-        return {k: to_json_safe(v) for k, v in value.items()}
-    if isinstance(value, Decimal):
-        return int(value) if value % 1 == 0 else float(value)
-    return value
-
-
+@lru_cache(maxsize=None)
 def stations_table():
     return dynamodb.Table(os.environ["STATIONS_TABLE"])
 
 
+@lru_cache(maxsize=None)
 def owners_table():
     return dynamodb.Table(os.environ["OWNERS_TABLE"])
 
 
+@lru_cache(maxsize=None)
 def admins_table():
     return dynamodb.Table(os.environ["ADMINS_TABLE"])
 
@@ -51,12 +86,29 @@ def now_epoch() -> int:
     return int(time.time())
 
 
-def token_secret() -> str:
-    return os.getenv("ADMIN_SESSION_SECRET", "").strip() or "unsafe-dev-secret"
+@lru_cache(maxsize=1)
+def token_secret() -> bytes:
+    return (os.getenv("ADMIN_SESSION_SECRET", "").strip() or "unsafe-dev-secret").encode("utf-8")
+
+
+@lru_cache(maxsize=1)
+def token_hmac() -> hmac.HMAC:
+    # Keyed once per container; copies reuse the absorbed ipad/opad blocks.
+    return hmac.new(token_secret(), digestmod=hashlib.sha256)
+
+
+def sign_token_payload(payload_part: bytes) -> bytes:
+    mac = token_hmac().copy()
+    mac.update(payload_part)
+    return mac.digest()
+
+
+def b64url_encode_bytes(raw: bytes) -> bytes:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=")
 
 
 def b64url_encode(raw: bytes) -> str:
-    return base64.urlsafe_b64encode(raw).decode("utf-8").rstrip("=")
+    return b64url_encode_bytes(raw).decode("ascii")
 
 
 def b64url_decode(value: str) -> bytes:
@@ -64,18 +116,70 @@ def b64url_decode(value: str) -> bytes:
     return base64.urlsafe_b64decode(value + padding)
 
 
-def password_hash(password: str, salt_hex: str, iterations: int) -> str:
-    raw = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), bytes.fromhex(salt_hex), iterations)
+def clean_str(value, upper: bool = False) -> str:
+    if isinstance(value, str):
+        text = value.strip()
+    elif value is None:
+        text = ""
+    else:
+        text = str(value).strip()
+    return text.upper() if upper else text
+
+
+def password_hash_digest() -> str:
+    digest = os.getenv("PASSWORD_HASH_DIGEST", "sha512").strip().lower()
+    return digest if digest in PASSWORD_DIGESTS else "sha512"
+
+
+def password_hash_iterations() -> int:
+    raw = os.getenv("PASSWORD_HASH_ITERATIONS", "210000")
+    try:
+        return max(1, int(raw))
+    except ValueError:
+        return 210_000
+
+
+def valid_scrypt_cost(cost: int) -> bool:
+    # scrypt needs a power of two above 1.
+    return 2 <= cost <= SCRYPT_MAX_COST and not cost & (cost - 1)
+
+
+def password_scrypt_cost() -> int:
+    raw = os.getenv("PASSWORD_SCRYPT_N", "131072")
+    try:
+        cost = int(raw)
+    except ValueError:
+        return 131_072
+    if not valid_scrypt_cost(cost):
+        return 131_072
+    return cost
+
+
+def password_hash(password: str, salt_hex: str, iterations: int, digest: str = "sha256") -> str:
+    if digest == "scrypt":
+        raw = hashlib.scrypt(
+            password.encode("utf-8"),
+            salt=bytes.fromhex(salt_hex),
+            n=iterations,
+            r=SCRYPT_BLOCK_SIZE,
+            p=1,
+            maxmem=256 * SCRYPT_BLOCK_SIZE * iterations,
+            dklen=64,
+        )
+        return raw.hex()
+    raw = hashlib.pbkdf2_hmac(digest, password.encode("utf-8"), bytes.fromhex(salt_hex), iterations)
     return raw.hex()
 
 
 def create_password_fields(password: str) -> dict:
     salt_hex = secrets.token_hex(16)
-    iterations = 200_000
+    digest = password_hash_digest()
+    iterations = password_scrypt_cost() if digest == "scrypt" else password_hash_iterations()
     return {
         "password_salt": salt_hex,
         "password_iterations": iterations,
-        "password_hash": password_hash(password, salt_hex, iterations),
+        "password_digest": digest,
+        "password_hash": password_hash(password, salt_hex, iterations, digest),
     }
 
 
@@ -86,81 +190,146 @@ def verify_password(password: str, item: dict) -> bool:
         iterations = int(item.get("password_iterations", 200_000))
     except (KeyError, ValueError, TypeError):
         return False
-    actual = password_hash(password, salt_hex, iterations)
+    digest = str(item.get("password_digest", "sha256"))
+    if digest not in PASSWORD_DIGESTS:
+        return False
+    if digest == "scrypt" and not valid_scrypt_cost(iterations):
+        return False
+    actual = password_hash(password, salt_hex, iterations, digest)
     return hmac.compare_digest(expected, actual)
 
 
-def new_session_token(username: str, ttl_minutes: int = 480) -> tuple[str, int]:
-    exp = now_epoch() + (ttl_minutes * 60)
+def hash_short_code(code: str, salt_hex: str) -> str:
+    return hmac.new(bytes.fromhex(salt_hex), code.encode("utf-8"), hashlib.sha256).hexdigest()
+
+
+def new_session_token(username: str, ttl_minutes: int = 480, now: int | None = None) -> tuple[str, int]:
+    exp = (now_epoch() if now is None else now) + (ttl_minutes * 60)
     payload = {"username": username, "exp": exp}
-    payload_part = b64url_encode(json.dumps(payload, separators=(",", ":"), sort_keys=True).encode("utf-8"))
-    sig = hmac.new(token_secret().encode("utf-8"), payload_part.encode("utf-8"), hashlib.sha256).digest()
-    token = f"{payload_part}.{b64url_encode(sig)}"
+    payload_part = b64url_encode_bytes(json.dumps(payload, separators=(",", ":"), sort_keys=True).encode("utf-8"))
+    sig = sign_token_payload(payload_part)
+    token = (payload_part + b"." + b64url_encode_bytes(sig)).decode("ascii")
     return token, exp
 
 
 def parse_bearer_token(headers: dict) -> str:
-    auth = headers.get("authorization") or headers.get("Authorization") or ""
+    auth = headers.get("authorization", "")
     if not auth.lower().startswith("bearer "):
         return ""
     return auth.split(" ", 1)[1].strip()
 
 
-def verify_session_token(token: str) -> str:
+def decode_session_token(token: str) -> tuple[str, int]:
     if "." not in token:
-        return ""
+        return "", 0
     payload_part, sig_part = token.split(".", 1)
-    expected_sig = hmac.new(
-        token_secret().encode("utf-8"),
-        payload_part.encode("utf-8"),
-        hashlib.sha256,
-    ).digest()
-    if not hmac.compare_digest(b64url_encode(expected_sig), sig_part):
-        return ""
+    if len(sig_part) != TOKEN_SIG_LENGTH or not 8 <= len(payload_part) <= TOKEN_PAYLOAD_MAX_LENGTH:
+        return "", 0
+    expected_sig = sign_token_payload(payload_part.encode("utf-8"))
+    try:
+        client_sig = b64url_decode(sig_part)
+    except ValueError:
+        return "", 0
+    if not hmac.compare_digest(expected_sig, client_sig):
+        return "", 0
     try:
         payload = json.loads(b64url_decode(payload_part).decode("utf-8"))
     except (json.JSONDecodeError, ValueError, UnicodeDecodeError):
-        return ""
-    if now_epoch() >= int(payload.get("exp", 0)):
-        return ""
-    return str(payload.get("username", "")).strip()
+        return "", 0
+    exp = int(payload.get("exp", 0))
+    if now_epoch() >= exp:
+        return "", 0
+    return str(payload.get("username", "")).strip(), exp
+
+
+def verify_cache_ttl_seconds() -> int:
+    raw = os.getenv("ADMIN_VERIFY_CACHE_TTL", "5")
+    try:
+        return max(0, int(raw))
+    except ValueError:
+        return 5
+
+
+def verify_session_token(token: str) -> str:
+    # Dashboard requests repeat the same bearer token; skip re-checking the
+    # signature for a few seconds, never past the token's own expiry.
+    ttl = verify_cache_ttl_seconds()
+    now = now_epoch()
+    if ttl:
+        cached = _verify_cache.get(token)
+        if cached and now < cached[1]:
+            return cached[0]
+    username, exp = decode_session_token(token)
+    if ttl and username:
+        if len(_verify_cache) >= VERIFY_CACHE_MAX_ENTRIES:
+            _verify_cache.clear()
+        _verify_cache[token] = (username, min(exp, now + ttl))
+    return username
 
 
 def is_bootstrapped() -> bool:
-    resp = admins_table().scan(Limit=1, ProjectionExpression="username")
-    return bool(resp.get("Items"))
+    table = admins_table()
+    resp = table.get_item(Key={"username": BOOTSTRAP_SENTINEL}, ProjectionExpression="username")
+    if resp.get("Item"):
+        return True
+    # Tables bootstrapped before the sentinel existed: find the admin once and
+    # record the sentinel so later checks stay a point read.
+    resp = table.scan(Limit=1, ProjectionExpression="username")
+    if not resp.get("Items"):
+        return False
+    table.put_item(Item={"username": BOOTSTRAP_SENTINEL})
+    return True
 
 
 def get_admin(username: str) -> dict:
-    if not username:
+    if not username or username == BOOTSTRAP_SENTINEL:
         return {}
     resp = admins_table().get_item(Key={"username": username})
     return resp.get("Item", {})
 
 
 def bootstrap_admin(body: dict) -> dict:
-    if is_bootstrapped():
-        return {"error": "admin user already exists"}
-    username = str(body.get("username", "")).strip()
+    username = clean_str(body.get("username"))
     password = str(body.get("password", ""))
     if not username or not password:
         return {"error": "username and password are required"}
+    if username == BOOTSTRAP_SENTINEL:
+        return {"error": "username is reserved"}
     if len(password) < 10:
         return {"error": "password must be at least 10 characters"}
-    fields = create_password_fields(password)
-    admins_table().put_item(
-        Item={
-            "username": username,
-            **fields,
-            "updated_at_epoch": now_epoch(),
-        }
-    )
-    token, exp = new_session_token(username)
+    # Also covers tables bootstrapped before the sentinel existed.
+    if is_bootstrapped():
+        return {"error": "admin user already exists"}
+    now = now_epoch()
+    table = admins_table()
+    try:
+        table.put_item(
+            Item={"username": BOOTSTRAP_SENTINEL, "updated_at_epoch": now},
+            ConditionExpression="attribute_not_exists(username)",
+        )
+    except ClientError as exc:
+        if exc.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+            return {"error": "admin user already exists"}
+        raise
+    try:
+        # Hash only once the claim succeeds so rejected requests stay cheap.
+        fields = create_password_fields(password)
+        table.put_item(
+            Item={
+                "username": username,
+                **fields,
+                "updated_at_epoch": now,
+            }
+        )
+    except Exception:
+        table.delete_item(Key={"username": BOOTSTRAP_SENTINEL})
+        raise
+    token, exp = new_session_token(username, now=now)
     return {"ok": True, "bootstrapped": True, "token": token, "expires_at_epoch": exp}
 
 
 def login(body: dict) -> dict:
-    username = str(body.get("username", "")).strip()
+    username = clean_str(body.get("username"))
     password = str(body.get("password", ""))
     if not username or not password:
         return {"error": "username and password are required"}
@@ -172,35 +341,32 @@ def login(body: dict) -> dict:
 
 
 def request_password_reset(body: dict) -> dict:
-    username = str(body.get("username", "")).strip()
+    username = clean_str(body.get("username"))
     if not username:
         return {"error": "username is required"}
     item = get_admin(username)
     if not item:
         return {"error": "unknown username"}
     reset_code = f"{secrets.randbelow(1_000_000):06d}"
-    code_fields = create_password_fields(reset_code)
-    expires_at = now_epoch() + 1800
+    reset_salt = secrets.token_hex(16)
+    now = now_epoch()
+    expires_at = now + 1800
     admins_table().update_item(
         Key={"username": username},
-        UpdateExpression=(
-            "SET reset_hash=:h, reset_salt=:s, reset_iterations=:i, "
-            "reset_expires_epoch=:e, updated_at_epoch=:u"
-        ),
+        UpdateExpression=RESET_UPDATE_EXPRESSION,
         ExpressionAttributeValues={
-            ":h": code_fields["password_hash"],
-            ":s": code_fields["password_salt"],
-            ":i": code_fields["password_iterations"],
+            ":h": hash_short_code(reset_code, reset_salt),
+            ":s": reset_salt,
             ":e": expires_at,
-            ":u": now_epoch(),
+            ":u": now,
         },
     )
     return {"ok": True, "username": username, "reset_code": reset_code, "expires_at_epoch": expires_at}
 
 
 def confirm_password_reset(body: dict) -> dict:
-    username = str(body.get("username", "")).strip()
-    reset_code = str(body.get("reset_code", "")).strip()
+    username = clean_str(body.get("username"))
+    reset_code = clean_str(body.get("reset_code"))
     new_password = str(body.get("new_password", ""))
     if not username or not reset_code or not new_password:
         return {"error": "username, reset_code, and new_password are required"}
@@ -209,37 +375,45 @@ def confirm_password_reset(body: dict) -> dict:
     item = get_admin(username)
     if not item:
         return {"error": "unknown username"}
-    if now_epoch() > int(item.get("reset_expires_epoch", 0)):
+    now = now_epoch()
+    if now > int(item.get("reset_expires_epoch", 0)):
         return {"error": "reset code expired"}
-    reset_ok = verify_password(
-        reset_code,
-        {
-            "password_hash": item.get("reset_hash", ""),
-            "password_salt": item.get("reset_salt", ""),
-            "password_iterations": item.get("reset_iterations", 200_000),
-        },
-    )
-    if not reset_ok:
+    expected_hash = str(item.get("reset_hash", ""))
+    try:
+        actual = hash_short_code(reset_code, str(item.get("reset_salt", "")))
+    except ValueError:
+        return {"error": "invalid reset code"}
+    if not hmac.compare_digest(expected_hash, actual):
         return {"error": "invalid reset code"}
     pw_fields = create_password_fields(new_password)
-    admins_table().update_item(
-        Key={"username": username},
-        UpdateExpression=(
-            "SET password_hash=:h, password_salt=:s, password_iterations=:i, updated_at_epoch=:u "
-            "REMOVE reset_hash, reset_salt, reset_iterations, reset_expires_epoch"
-        ),
-        ExpressionAttributeValues={
-            ":h": pw_fields["password_hash"],
-            ":s": pw_fields["password_salt"],
-            ":i": pw_fields["password_iterations"],
-            ":u": now_epoch(),
-        },
-    )
+    try:
+        # The condition consumes the code atomically: a concurrent confirm, a
+        # newer reset request, or expiry in the meantime all fail the write.
+        admins_table().update_item(
+            Key={"username": username},
+            UpdateExpression=CONFIRM_UPDATE_EXPRESSION,
+            ConditionExpression=CONFIRM_CONDITION_EXPRESSION,
+            ExpressionAttributeValues={
+                ":h": pw_fields["password_hash"],
+                ":s": pw_fields["password_salt"],
+                ":i": pw_fields["password_iterations"],
+                ":d": pw_fields["password_digest"],
+                ":u": now,
+                ":rh": expected_hash,
+            },
+        )
+    except ClientError as exc:
+        if exc.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+            return {"error": "invalid reset code"}
+        raise
     return {"ok": True, "username": username}
 
 
-def require_auth(event: dict) -> str:
-    headers = event.get("headers") or {}
+def normalize_headers(event: dict) -> dict:
+    return {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+
+
+def require_auth(headers: dict) -> str:
     token = parse_bearer_token(headers)
     return verify_session_token(token)
 
@@ -248,41 +422,79 @@ def auth_status() -> dict:
     return {"bootstrapped": is_bootstrapped()}
 
 
-def list_stations() -> list[dict]:
-    result = stations_table().scan()
-    items = result.get("Items", [])
-    items.sort(key=lambda i: i.get("station_id", ""))
+def scan_all(table, **kwargs) -> list[dict]:
+    items = []
+    while True:
+        result = table.scan(**kwargs)
+        items.extend(result.get("Items", []))
+        last_key = result.get("LastEvaluatedKey")
+        if not last_key:
+            return items
+        kwargs["ExclusiveStartKey"] = last_key
+
+
+def cached_list(kind: str, loader) -> list[dict]:
+    now = time.time()
+    cached = _list_cache.get(kind)
+    if cached and now - cached[0] < LIST_CACHE_TTL_SECONDS:
+        return cached[1]
+    items = loader()
+    _list_cache[kind] = (now, items)
     return items
 
 
-def list_owners() -> list[dict]:
-    result = owners_table().scan()
-    items = result.get("Items", [])
-    items.sort(key=lambda i: i.get("owner_id", ""))
+def invalidate_list_cache(kind: str) -> None:
+    _list_cache.pop(kind, None)
+
+
+def load_stations() -> list[dict]:
+    items = scan_all(
+        stations_table(),
+        ProjectionExpression="station_id, enabled, owner_id, notify_on, cooldown_minutes, alerts_enabled",
+    )
+    items.sort(key=itemgetter("station_id"))
     return items
 
 
+def load_owners() -> list[dict]:
+    items = scan_all(owners_table(), ProjectionExpression="owner_id, topic_arn, alerts_enabled")
+    items.sort(key=itemgetter("owner_id"))
+    return items
+
+
+def list_stations() -> list[dict]:
+    return cached_list("stations", load_stations)
+
+
+def list_owners() -> list[dict]:
+    return cached_list("owners", load_owners)
+
+
 def add_station(body: dict) -> dict:
-    station_id = str(body.get("station_id", "")).strip().upper()
+    station_id = clean_str(body.get("station_id"), upper=True)
     if not station_id:
         return {"error": "station_id is required"}
     item = {
         "station_id": station_id,
         "enabled": bool(body.get("enabled", True)),
-        "owner_id": str(body.get("owner_id", "")).strip(),
+        "owner_id": clean_str(body.get("owner_id")),
         "notify_on": str(body.get("notify_on", "both")).lower(),
         "cooldown_minutes": int(body.get("cooldown_minutes", 60)),
         "alerts_enabled": bool(body.get("alerts_enabled", True)),
     }
     if item["notify_on"] not in {"error", "empty", "both"}:
         return {"error": "notify_on must be error|empty|both"}
+    if item["enabled"]:
+        # Sparse key for the stations EnabledIndex GSI read by the collector.
+        item["enabled_flag"] = "1"
     stations_table().put_item(Item=item)
+    invalidate_list_cache("stations")
     return {"ok": True, "item": item}
 
 
 def add_owner(body: dict) -> dict:
-    owner_id = str(body.get("owner_id", "")).strip()
-    topic_arn = str(body.get("topic_arn", "")).strip()
+    owner_id = clean_str(body.get("owner_id"))
+    topic_arn = clean_str(body.get("topic_arn"))
     if not owner_id:
         return {"error": "owner_id is required"}
     if not topic_arn:
@@ -293,22 +505,25 @@ def add_owner(body: dict) -> dict:
         "alerts_enabled": bool(body.get("alerts_enabled", True)),
     }
     owners_table().put_item(Item=item)
+    invalidate_list_cache("owners")
     return {"ok": True, "item": item}
 
 
 def delete_station(station_id: str) -> dict:
-    sid = station_id.strip().upper()
+    sid = clean_str(station_id, upper=True)
     if not sid:
         return {"error": "station_id is required"}
     stations_table().delete_item(Key={"station_id": sid})
+    invalidate_list_cache("stations")
     return {"ok": True, "station_id": sid}
 
 
 def delete_owner(owner_id: str) -> dict:
-    oid = owner_id.strip()
+    oid = clean_str(owner_id)
     if not oid:
         return {"error": "owner_id is required"}
     owners_table().delete_item(Key={"owner_id": oid})
+    invalidate_list_cache("owners")
     return {"ok": True, "owner_id": oid}
 
 
@@ -325,8 +540,8 @@ def lambda_handler(event, context):
         if method == "GET" and kind == "auth":
             return response(200, auth_status())
 
+        body = json.loads(event.get("body") or "{}") if method == "POST" else {}
         if method == "POST":
-            body = json.loads(event.get("body") or "{}")
             action = str(body.get("action", "")).lower()
             if action == "bootstrap":
                 result = bootstrap_admin(body)
@@ -341,7 +556,7 @@ def lambda_handler(event, context):
                 result = confirm_password_reset(body)
                 return response(400 if "error" in result else 200, result)
 
-        username = require_auth(event)
+        username = require_auth(normalize_headers(event))
         if not username:
             return response(401, {"error": "Unauthorized"})
 
@@ -353,7 +568,6 @@ def lambda_handler(event, context):
             return response(200, {"type": "stations", "count": len(items), "items": items, "user": username})
 
         if method == "POST":
-            body = json.loads(event.get("body") or "{}")
             result = add_owner(body) if kind == "owners" else add_station(body)
             if "error" in result:
                 return response(400, result)
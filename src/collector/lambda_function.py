@@ -1,31 +1,70 @@
 import json
 import os
-import urllib.error
+import time
 import urllib.parse
 import urllib.request
 import xml.etree.ElementTree as ET
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 
 import boto3
-from boto3.dynamodb.conditions import Attr
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.config import Config
+from botocore.exceptions import ClientError
 
 BASE_URL = "https://aviationweather.gov/api/data/metar"
-dynamodb = boto3.resource("dynamodb")
-events = boto3.client("events")
+# EventBridge PutEvents accepts at most 10 entries per call.
+EVENTS_BATCH_SIZE = 10
+# DynamoDB BatchWriteItem accepts at most 25 put requests per call.
+DYNAMODB_BATCH_SIZE = 25
+MAX_BATCH_WRITE_ATTEMPTS = 5
+ALERT_STATUSES = frozenset(("error", "empty"))
+ERROR_STATUSES = frozenset(("error",))
+EVENT_ENTRY_TEMPLATE = {"Source": "metar.monitor", "DetailType": "station-alert"}
+# Compact separators keep PutEvents payloads small.
+DETAIL_ENCODER = json.JSONEncoder(separators=(",", ":"))
+SHARED_DETAIL_FIELDS = ("checked_at_utc", "source_url", "error_message")
+STATION_CONFIG_PROJECTION = "station_id, owner_id, notify_on, cooldown_minutes, alerts_enabled"
+METAR_FIELDS = (
+    "station_id",
+    "observation_time",
+    "temp_c",
+    "dewpoint_c",
+    "wind_dir_degrees",
+    "wind_speed_kt",
+    "visibility_statute_mi",
+    "altim_in_hg",
+    "flight_category",
+    "raw_text",
+)
+# Everything parse_metar_xml extracts beyond the table's key attributes.
+METAR_DATA_FIELDS = METAR_FIELDS[2:]
+AWS_CONFIG = Config(
+    tcp_keepalive=True,
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "max_attempts": 10},
+)
+# One session per container so every client shares its credentials and
+# keep-alive connection pool across warm invocations.
+session = boto3.session.Session()
+dynamodb = session.resource("dynamodb", config=AWS_CONFIG)
+dynamodb_client = session.client("dynamodb", config=AWS_CONFIG)
+events = session.client("events", config=AWS_CONFIG)
+
+
+@lru_cache(maxsize=None)
+def dynamo_table(name: str):
+    return dynamodb.Table(name)
 
 
 def utc_now_iso() -> str:
     return datetime.now(timezone.utc).replace(microsecond=0).isoformat()
 
 
-def parse_utc_iso(iso_str: str) -> datetime:
-    normalized = iso_str.replace("Z", "+00:00")
-    return datetime.fromisoformat(normalized).astimezone(timezone.utc)
-
-
-def expiration_from_iso(iso_str: str, days: int) -> int:
-    dt = parse_utc_iso(iso_str)
-    return int((dt + timedelta(days=days)).timestamp())
+def epoch_from_iso(iso_str: str) -> int:
+    # fromisoformat accepts a trailing "Z" on Python 3.11+, and timestamp()
+    # is timezone-independent for aware values, so no normalization is needed.
+    return int(datetime.fromisoformat(iso_str).timestamp())
 
 
 def expiration_from_now(days: int) -> int:
@@ -48,17 +87,88 @@ def get_stale_threshold_hours() -> float:
         return 2.0
 
 
+@lru_cache(maxsize=1)
+def handler_settings() -> dict:
+    # Lambda environment variables are fixed for the life of the container.
+    return {
+        "metars_table": os.environ["METARS_TABLE"],
+        "runs_table": os.environ["RUNS_TABLE"],
+        "alert_on_empty": os.getenv("ALERT_ON_EMPTY", "true").lower() == "true",
+        "router_event_bus": os.getenv("ROUTER_EVENT_BUS", "default"),
+        "metar_retention_days": get_retention_days("METAR_RETENTION_DAYS", 30),
+        "run_retention_days": get_retention_days("RUN_RETENTION_DAYS", 30),
+        "stale_threshold_hours": get_stale_threshold_hours(),
+    }
+
+
+def query_enabled_stations(stations_table) -> list[dict]:
+    kwargs = {
+        "IndexName": "EnabledIndex",
+        "KeyConditionExpression": Key("enabled_flag").eq("1"),
+        "ProjectionExpression": STATION_CONFIG_PROJECTION,
+    }
+    items = []
+    while True:
+        result = stations_table.query(**kwargs)
+        items.extend(result.get("Items", []))
+        last_key = result.get("LastEvaluatedKey")
+        if not last_key:
+            return items
+        kwargs["ExclusiveStartKey"] = last_key
+
+
+def scan_enabled_stations(stations_table) -> list[dict]:
+    kwargs = {
+        "ProjectionExpression": f"{STATION_CONFIG_PROJECTION}, enabled_flag",
+        "FilterExpression": Attr("enabled").eq(True),
+    }
+    items = []
+    while True:
+        result = stations_table.scan(**kwargs)
+        items.extend(result.get("Items", []))
+        last_key = result.get("LastEvaluatedKey")
+        if not last_key:
+            return items
+        kwargs["ExclusiveStartKey"] = last_key
+
+
+def backfill_enabled_flags(stations_table, items: list[dict]) -> int:
+    # Stations saved before EnabledIndex existed carry no enabled_flag; add it
+    # so they show up in the index once STATION_INDEX_READY is switched on.
+    backfilled = 0
+    for item in items:
+        if item.get("enabled_flag") == "1":
+            continue
+        try:
+            stations_table.update_item(
+                Key={"station_id": item["station_id"]},
+                UpdateExpression="SET enabled_flag = :f",
+                ConditionExpression="enabled = :t",
+                ExpressionAttributeValues={":f": "1", ":t": True},
+            )
+        except ClientError as exc:
+            # Disabled by an admin since the scan; leave it out of the index.
+            if exc.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise
+            continue
+        backfilled += 1
+    return backfilled
+
+
+def station_index_ready() -> bool:
+    return os.getenv("STATION_INDEX_READY", "false").lower() == "true"
+
+
 def get_station_configs() -> list[dict]:
     stations_table_name = os.getenv("STATIONS_TABLE", "")
     if stations_table_name:
-        stations_table = dynamodb.Table(stations_table_name)
-        result = stations_table.scan(
-            ProjectionExpression=(
-                "station_id, enabled, owner_id, notify_on, cooldown_minutes, alerts_enabled"
-            ),
-            FilterExpression=Attr("enabled").eq(True),
-        )
-        items = result.get("Items", [])
+        stations_table = dynamo_table(stations_table_name)
+        if station_index_ready():
+            items = query_enabled_stations(stations_table)
+        else:
+            items = scan_enabled_stations(stations_table)
+            backfilled = backfill_enabled_flags(stations_table, items)
+            print(json.dumps({"status": "enabled_flag_backfill", "backfilled": backfilled}))
         configs = []
         for i in items:
             station_id = str(i.get("station_id", "")).strip().upper()
@@ -103,69 +213,83 @@ def build_url(station_ids: list[str]) -> str:
     return f"{BASE_URL}?{query}"
 
 
-def fetch_xml(url: str) -> str:
-    with urllib.request.urlopen(url, timeout=20) as response:
-        return response.read().decode("utf-8")
-
-
-def parse_metar_xml(xml_text: str) -> list[dict]:
-    root = ET.fromstring(xml_text)
+def parse_metar_xml(source) -> list[dict]:
     metars = []
 
-    for metar in root.findall(".//METAR"):
-        station_id = metar.findtext("station_id")
-        observation_time = metar.findtext("observation_time")
-
-        if not station_id or not observation_time:
+    for _, metar in ET.iterparse(source):
+        if metar.tag != "METAR":
+            continue
+        record = dict.fromkeys(METAR_FIELDS)
+        for child in metar:
+            tag = child.tag
+            if tag in record and record[tag] is None:
+                record[tag] = child.text or ""
+        metar.clear()
+
+        if not record["station_id"] or not record["observation_time"]:
             continue
 
-        metars.append(
-            {
-                "station_id": station_id,
-                "observation_time": observation_time,
-                "temp_c": metar.findtext("temp_c"),
-                "dewpoint_c": metar.findtext("dewpoint_c"),
-                "wind_dir_degrees": metar.findtext("wind_dir_degrees"),
-                "wind_speed_kt": metar.findtext("wind_speed_kt"),
-                "visibility_statute_mi": metar.findtext("visibility_statute_mi"),
-                "altim_in_hg": metar.findtext("altim_in_hg"),
-                "flight_category": metar.findtext("flight_category"),
-                "raw_text": metar.findtext("raw_text"),
-            }
-        )
+        metars.append(record)
 
     return metars
 
 
+def fetch_metars(url: str) -> list[dict]:
+    with urllib.request.urlopen(url, timeout=20) as response:
+        return parse_metar_xml(response)
+
+
+def to_attribute_value(value) -> dict:
+    if value is None:
+        return {"NULL": True}
+    if isinstance(value, int):
+        return {"N": str(value)}
+    return {"S": str(value)}
+
+
+def batch_put_items(table_name: str, items: list[dict]) -> None:
+    for start in range(0, len(items), DYNAMODB_BATCH_SIZE):
+        chunk = items[start : start + DYNAMODB_BATCH_SIZE]
+        request_items = {table_name: [{"PutRequest": {"Item": item}} for item in chunk]}
+        attempt = 1
+        while True:
+            resp = dynamodb_client.batch_write_item(RequestItems=request_items)
+            request_items = resp.get("UnprocessedItems") or {}
+            if not request_items:
+                break
+            if attempt >= MAX_BATCH_WRITE_ATTEMPTS:
+                pending = sum(len(v) for v in request_items.values())
+                raise RuntimeError(f"{pending} items still unprocessed after {attempt} batch write attempts")
+            time.sleep(min(0.05 * (2**attempt), 1.0))
+            attempt += 1
+
+
 def write_metars(
     metars_table_name: str,
     metars: list[dict],
     collected_at: str,
     retention_days: int,
 ) -> None:
-    table = dynamodb.Table(metars_table_name)
-    with table.batch_writer(overwrite_by_pkeys=["station_id", "observation_time"]) as batch:
-        for m in metars:
-            try:
-                expires_at = expiration_from_iso(m["observation_time"], retention_days)
-            except ValueError:
-                expires_at = expiration_from_now(retention_days)
-            batch.put_item(
-                Item={
-                    "station_id": m["station_id"],
-                    "observation_time": m["observation_time"],
-                    "collected_at": collected_at,
-                    "expires_at": expires_at,
-                    "temp_c": m.get("temp_c"),
-                    "dewpoint_c": m.get("dewpoint_c"),
-                    "wind_dir_degrees": m.get("wind_dir_degrees"),
-                    "wind_speed_kt": m.get("wind_speed_kt"),
-                    "visibility_statute_mi": m.get("visibility_statute_mi"),
-                    "altim_in_hg": m.get("altim_in_hg"),
-                    "flight_category": m.get("flight_category"),
-                    "raw_text": m.get("raw_text"),
-                }
-            )
+    retention_seconds = retention_days * 86400
+    fallback_expires_at = expiration_from_now(retention_days)
+    # BatchWriteItem rejects duplicate keys within one request; keep the last.
+    unique = {(m["station_id"], m["observation_time"]): m for m in metars}
+    items = []
+    for m in unique.values():
+        try:
+            expires_at = epoch_from_iso(m["observation_time"]) + retention_seconds
+        except ValueError:
+            expires_at = fallback_expires_at
+        item = {
+            "station_id": {"S": m["station_id"]},
+            "observation_time": {"S": m["observation_time"]},
+            "collected_at": {"S": collected_at},
+            "expires_at": {"N": str(expires_at)},
+        }
+        for field in METAR_DATA_FIELDS:
+            item[field] = to_attribute_value(m.get(field))
+        items.append(item)
+    batch_put_items(metars_table_name, items)
 
 
 def write_run(
@@ -178,7 +302,7 @@ def write_run(
     retention_days: int,
     error_message: str | None = None,
 ) -> None:
-    table = dynamodb.Table(runs_table_name)
+    table = dynamo_table(runs_table_name)
     item = {
         "pk": "RUN",
         "checked_at_utc": checked_at_utc,
@@ -195,20 +319,37 @@ def write_run(
     table.put_item(Item=item)
 
 
+def encode_event_details(station_events: list[dict]) -> list[str]:
+    # Events from one run share these fields, so encode them once as a JSON
+    # prefix and only serialize the per-station remainder for each event.
+    prefixes: dict[tuple, str] = {}
+    details = []
+    for e in station_events:
+        shared = tuple(e.get(k) for k in SHARED_DETAIL_FIELDS)
+        prefix = prefixes.get(shared)
+        if prefix is None:
+            prefix = DETAIL_ENCODER.encode(dict(zip(SHARED_DETAIL_FIELDS, shared)))[:-1]
+            prefixes[shared] = prefix
+        rest = {k: v for k, v in e.items() if k not in SHARED_DETAIL_FIELDS}
+        details.append(f"{prefix},{DETAIL_ENCODER.encode(rest)[1:]}" if rest else prefix + "}")
+    return details
+
+
 def publish_station_alert_events(station_events: list[dict], event_bus_name: str) -> None:
     if not station_events:
         return
 
-    entries = [
-        {
-            "Source": "metar.monitor",
-            "DetailType": "station-alert",
-            "EventBusName": event_bus_name,
-            "Detail": json.dumps(e),
-        }
-        for e in station_events
-    ]
-    events.put_events(Entries=entries)
+    template = {**EVENT_ENTRY_TEMPLATE, "EventBusName": event_bus_name}
+    entries = []
+    for detail in encode_event_details(station_events):
+        entry = template.copy()
+        entry["Detail"] = detail
+        entries.append(entry)
+    for start in range(0, len(entries), EVENTS_BATCH_SIZE):
+        resp = events.put_events(Entries=entries[start : start + EVENTS_BATCH_SIZE])
+        if resp.get("FailedEntryCount"):
+            failures = [r for r in resp.get("Entries", []) if r.get("ErrorCode")]
+            print(json.dumps({"status": "put_events_failed", "failures": failures}))
 
 
 def station_alert_events(
@@ -241,9 +382,8 @@ def station_alert_events(
 
 
 def filter_alert_events(events_payload: list[dict], alert_on_empty: bool) -> list[dict]:
-    if alert_on_empty:
-        return events_payload
-    return [e for e in events_payload if e.get("status") == "error"]
+    allowed = ALERT_STATUSES if alert_on_empty else ERROR_STATUSES
+    return [e for e in events_payload if e.get("status") in allowed]
 
 
 def lambda_handler(event, context):
@@ -251,17 +391,17 @@ def lambda_handler(event, context):
     station_configs = get_station_configs()
     station_ids = [c["station_id"] for c in station_configs]
     source_url = build_url(station_ids)
-    metars_table = os.environ["METARS_TABLE"]
-    runs_table = os.environ["RUNS_TABLE"]
-    alert_on_empty = os.getenv("ALERT_ON_EMPTY", "true").lower() == "true"
-    router_event_bus = os.getenv("ROUTER_EVENT_BUS", "default")
-    metar_retention_days = get_retention_days("METAR_RETENTION_DAYS", 30)
-    run_retention_days = get_retention_days("RUN_RETENTION_DAYS", 30)
-    stale_threshold_hours = get_stale_threshold_hours()
+    settings = handler_settings()
+    metars_table = settings["metars_table"]
+    runs_table = settings["runs_table"]
+    alert_on_empty = settings["alert_on_empty"]
+    router_event_bus = settings["router_event_bus"]
+    metar_retention_days = settings["metar_retention_days"]
+    run_retention_days = settings["run_retention_days"]
+    stale_threshold_hours = settings["stale_threshold_hours"]
 
     try:
-        xml_body = fetch_xml(source_url)
-        metars = parse_metar_xml(xml_body)
+        metars = fetch_metars(source_url)
     except Exception as exc:  # noqa: BLE001
         err = str(exc)
         write_run(
@@ -312,40 +452,39 @@ def lambda_handler(event, context):
 
         return {"statusCode": 200, "body": json.dumps({"status": "empty", "count": 0})}
 
-    metar_counts: dict[str, int] = {sid: 0 for sid in station_ids}
-    latest_observation_by_station: dict[str, datetime] = {}
+    tracked_ids = set(station_ids)
+    seen_ids = {m["station_id"] for m in metars}
+    latest_observation_by_station: dict[str, int] = {}
     for m in metars:
         sid = m["station_id"]
-        if sid in metar_counts:
-            metar_counts[sid] += 1
+        if sid in tracked_ids:
             try:
-                observed_at = parse_utc_iso(m["observation_time"])
-                previous = latest_observation_by_station.get(sid)
-                if previous is None or observed_at > previous:
-                    latest_observation_by_station[sid] = observed_at
+                observed_at = epoch_from_iso(m["observation_time"])
             except (KeyError, TypeError, ValueError):
-                pass
-
-    station_statuses = {sid: ("ok" if metar_counts.get(sid, 0) > 0 else "empty") for sid in station_ids}
-    checked_at_dt = parse_utc_iso(checked_at)
-    for sid in station_ids:
-        latest = latest_observation_by_station.get(sid)
-        if latest is None:
-            continue
-        age_hours = (checked_at_dt - latest).total_seconds() / 3600
-        if age_hours > stale_threshold_hours:
+                continue
+            previous = latest_observation_by_station.get(sid)
+            if previous is None or observed_at > previous:
+                latest_observation_by_station[sid] = observed_at
+
+    station_statuses = {sid: ("ok" if sid in seen_ids else "empty") for sid in station_ids}
+    # One cutoff per run; each station is then a single integer comparison.
+    stale_cutoff = epoch_from_iso(checked_at) - stale_threshold_hours * 3600
+    for sid, latest in latest_observation_by_station.items():
+        if latest < stale_cutoff:
             station_statuses[sid] = "error"
 
-    station_events = station_alert_events(
-        station_configs=station_configs,
-        checked_at=checked_at,
-        source_url=source_url,
-        status_by_station=station_statuses,
-    )
-    publish_station_alert_events(
-        filter_alert_events(station_events, alert_on_empty=alert_on_empty),
-        event_bus_name=router_event_bus,
-    )
+    # Most runs see every station fresh; skip building payloads that would all be dropped.
+    if any(v != "ok" for v in station_statuses.values()):
+        station_events = station_alert_events(
+            station_configs=station_configs,
+            checked_at=checked_at,
+            source_url=source_url,
+            status_by_station=station_statuses,
+        )
+        publish_station_alert_events(
+            filter_alert_events(station_events, alert_on_empty=alert_on_empty),
+            event_bus_name=router_event_bus,
+        )
 
     run_status = "error" if any(v == "error" for v in station_statuses.values()) else "ok"
 
@@ -369,7 +508,8 @@ def lambda_handler(event, context):
         "status": "ok",
         "checked_at_utc": checked_at,
         "count": len(metars),
-        "stations": sorted({m["station_id"] for m in metars}),
+        "stations": sorted(seen_ids),
     }
-    print(json.dumps(payload))
-    return {"statusCode": 200, "body": json.dumps(payload)}
+    body = json.dumps(payload)
+    print(body)
+    return {"statusCode": 200, "body": body}
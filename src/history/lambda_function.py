@@ -1,41 +1,52 @@
 import json
 import os
 from decimal import Decimal
+from functools import lru_cache
 
 import boto3
 from boto3.dynamodb.conditions import Key
+from botocore.config import Config
 
+AWS_CONFIG = Config(
+    tcp_keepalive=True,
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "max_attempts": 10},
+)
+session = boto3.session.Session()
+dynamodb = session.resource("dynamodb", config=AWS_CONFIG)
 
-dynamodb = boto3.resource("dynamodb")
 
+@lru_cache(maxsize=None)
+def dynamo_table(name: str):
+    return dynamodb.Table(name)
 
-def cors_headers() -> dict:
-    return {
-        "Content-Type": "application/json",
-        "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Methods": "GET,OPTIONS",
-        "Access-Control-Allow-Headers": "Content-Type",
-    }
+
+RESPONSE_HEADERS = {
+    "Content-Type": "application/json",
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET,OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type",
+}
+
+
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, Decimal):
+            return int(o) if o % 1 == 0 else float(o)
+        return super().default(o)
+
+
+JSON_ENCODER = DecimalEncoder(separators=(",", ":"))
 
 
 def response(status_code: int, payload: dict) -> dict:
     return {
         "statusCode": status_code,
-        "headers": cors_headers(),
-        "body": json.dumps(to_json_safe(payload)),
+        "headers": RESPONSE_HEADERS,
+        "body": JSON_ENCODER.encode(payload),
     }
 
 
-def to_json_safe(value):
-    if isinstance(value, list):
-        return [to_json_safe(v) for v in value]
-    if isinstance(value, dict):
-        return {k: to_json_safe(v) for k, v in value.items()}
-    if isinstance(value, Decimal):
-        return int(value) if value % 1 == 0 else float(value)
-    return value
-
-
 def parse_limit(value: str | None, default_value: int) -> int:
     if not value:
         return default_value
@@ -47,7 +58,7 @@ def parse_limit(value: str | None, default_value: int) -> int:
 
 
 def get_runs(limit: int) -> list[dict]:
-    runs_table = dynamodb.Table(os.environ["RUNS_TABLE"])
+    runs_table = dynamo_table(os.environ["RUNS_TABLE"])
     result = runs_table.query(
         KeyConditionExpression=Key("pk").eq("RUN"),
         ScanIndexForward=False,
@@ -59,7 +70,7 @@ def get_runs(limit: int) -> list[dict]:
 
 
 def get_metars(station_id: str, limit: int) -> list[dict]:
-    metars_table = dynamodb.Table(os.environ["METARS_TABLE"])
+    metars_table = dynamo_table(os.environ["METARS_TABLE"])
     result = metars_table.query(
         KeyConditionExpression=Key("station_id").eq(station_id),
         ScanIndexForward=False,
@@ -75,7 +86,7 @@ def get_stations() -> list[dict]:
     if not stations_table_name:
         return [{"station_id": os.getenv("DEFAULT_STATION", "KJWY"), "enabled": True}]
 
-    stations_table = dynamodb.Table(stations_table_name)
+    stations_table = dynamo_table(stations_table_name)
     result = stations_table.scan(ProjectionExpression="station_id, enabled")
     items = result.get("Items", [])
     if not items:
@@ -86,7 +97,7 @@ def get_stations() -> list[dict]:
 
 def lambda_handler(event, context):
     if event.get("requestContext", {}).get("http", {}).get("method") == "OPTIONS":
-        return {"statusCode": 200, "headers": cors_headers(), "body": ""}
+        return {"statusCode": 200, "headers": RESPONSE_HEADERS, "body": ""}
 
     params = event.get("queryStringParameters") or {}
     data_type = (params.get("type") or "runs").lower()
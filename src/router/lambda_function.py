@@ -1,12 +1,34 @@
-import json
 import os
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 
 import boto3
-from boto3.dynamodb.conditions import Key
-
-dynamodb = boto3.resource("dynamodb")
-sns = boto3.client("sns")
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+AWS_CONFIG = Config(
+    tcp_keepalive=True,
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "max_attempts": 10},
+)
+# The DynamoDB resource and SNS client share this session's credentials.
+session = boto3.session.Session()
+dynamodb = session.resource("dynamodb", config=AWS_CONFIG)
+sns = session.client("sns", config=AWS_CONFIG)
+
+STATIONS_TABLE = os.getenv("STATIONS_TABLE", "")
+OWNERS_TABLE = os.getenv("OWNERS_TABLE", "")
+ALERT_STATE_TABLE = os.getenv("ALERT_STATE_TABLE", "")
+NOTIFY_CHOICES = frozenset(("error", "empty", "both"))
+ALERT_STATUSES = frozenset(("error", "empty"))
+OWNER_PROJECTION = "owner_id, alerts_enabled, topic_arn"
+# The claim succeeds only when no earlier notification is inside the cooldown window.
+COOLDOWN_CONDITION_EXPRESSION = "attribute_not_exists(last_notified_epoch) OR last_notified_epoch <= :cutoff"
+
+
+@lru_cache(maxsize=None)
+def dynamo_table(name: str):
+    return dynamodb.Table(name)
 
 
 def now_epoch() -> int:
@@ -15,13 +37,11 @@ def now_epoch() -> int:
 
 def parse_notify_on(value: str) -> str:
     v = (value or "both").lower()
-    if v in {"error", "empty", "both"}:
-        return v
-    return "both"
+    return v if v in NOTIFY_CHOICES else "both"
 
 
 def should_notify(status: str, notify_on: str) -> bool:
-    if status not in {"error", "empty"}:
+    if status not in ALERT_STATUSES:
         return False
     if notify_on == "both":
         return True
@@ -29,40 +49,44 @@ def should_notify(status: str, notify_on: str) -> bool:
 
 
 def get_station(table_name: str, station_id: str) -> dict:
-    table = dynamodb.Table(table_name)
+    table = dynamo_table(table_name)
     resp = table.get_item(Key={"station_id": station_id})
     return resp.get("Item", {})
 
 
 def get_owner(table_name: str, owner_id: str) -> dict:
-    table = dynamodb.Table(table_name)
-    resp = table.get_item(Key={"owner_id": owner_id})
+    table = dynamo_table(table_name)
+    resp = table.get_item(Key={"owner_id": owner_id}, ProjectionExpression=OWNER_PROJECTION)
     return resp.get("Item", {})
 
 
-def in_cooldown(table_name: str, station_id: str, alert_type: str, cooldown_minutes: int) -> bool:
-    table = dynamodb.Table(table_name)
-    resp = table.get_item(Key={"station_id": station_id, "alert_type": alert_type})
-    item = resp.get("Item")
-    if not item:
-        return False
-    last = int(item.get("last_notified_epoch", 0))
-    return (now_epoch() - last) < (cooldown_minutes * 60)
-
-
-def update_cooldown(table_name: str, station_id: str, alert_type: str, cooldown_minutes: int) -> None:
-    table = dynamodb.Table(table_name)
+def claim_cooldown(table_name: str, station_id: str, alert_type: str, cooldown_minutes: int) -> bool:
+    # Check and record the cooldown in one conditional write so concurrent
+    # invocations for the same station cannot both notify.
+    table = dynamo_table(table_name)
     current = now_epoch()
     expires_at = current + int(timedelta(days=30).total_seconds())
-    table.put_item(
-        Item={
-            "station_id": station_id,
-            "alert_type": alert_type,
-            "last_notified_epoch": current,
-            "expires_at": expires_at,
-            "cooldown_minutes": cooldown_minutes,
-        }
-    )
+    try:
+        table.put_item(
+            Item={
+                "station_id": station_id,
+                "alert_type": alert_type,
+                "last_notified_epoch": current,
+                "expires_at": expires_at,
+                "cooldown_minutes": cooldown_minutes,
+            },
+            ConditionExpression=COOLDOWN_CONDITION_EXPRESSION,
+            ExpressionAttributeValues={":cutoff": current - cooldown_minutes * 60},
+        )
+    except ClientError as exc:
+        if exc.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+            return False
+        raise
+    return True
+
+
+def release_cooldown(table_name: str, station_id: str, alert_type: str) -> None:
+    dynamo_table(table_name).delete_item(Key={"station_id": station_id, "alert_type": alert_type})
 
 
 def publish_owner_topic(topic_arn: str, subject: str, message: str, attrs: dict) -> None:
@@ -86,14 +110,10 @@ def lambda_handler(event, context):
     source_url = detail.get("source_url", "")
     error_message = detail.get("error_message", "")
 
-    if not station_id or status not in {"error", "empty"}:
+    if not station_id or status not in ALERT_STATUSES:
         return {"ok": True, "skipped": "invalid-event"}
 
-    stations_table = os.environ["STATIONS_TABLE"]
-    owners_table = os.environ["OWNERS_TABLE"]
-    state_table = os.environ["ALERT_STATE_TABLE"]
-
-    station = get_station(stations_table, station_id)
+    station = get_station(STATIONS_TABLE, station_id)
     if not station:
         return {"ok": True, "skipped": "station-not-found"}
     if not bool(station.get("alerts_enabled", True)):
@@ -107,7 +127,7 @@ def lambda_handler(event, context):
     if not owner_id:
         return {"ok": True, "skipped": "no-owner"}
 
-    owner = get_owner(owners_table, owner_id)
+    owner = get_owner(OWNERS_TABLE, owner_id)
     if not owner:
         return {"ok": True, "skipped": "owner-not-found"}
     if not bool(owner.get("alerts_enabled", True)):
@@ -118,7 +138,7 @@ def lambda_handler(event, context):
         return {"ok": True, "skipped": "no-owner-topic"}
 
     cooldown_minutes = int(station.get("cooldown_minutes", 60))
-    if in_cooldown(state_table, station_id, status, cooldown_minutes):
+    if not claim_cooldown(ALERT_STATE_TABLE, station_id, status, cooldown_minutes):
         return {"ok": True, "skipped": "cooldown"}
 
     subject = f"METAR {status.upper()} - {station_id}"
@@ -130,12 +150,16 @@ def lambda_handler(event, context):
         f"Error: {error_message or 'N/A'}\n"
     )
 
-    publish_owner_topic(
-        topic_arn,
-        subject,
-        msg,
-        {"station_id": station_id, "owner_id": owner_id, "status": status},
-    )
-    update_cooldown(state_table, station_id, status, cooldown_minutes)
+    try:
+        publish_owner_topic(
+            topic_arn,
+            subject,
+            msg,
+            {"station_id": station_id, "owner_id": owner_id, "status": status},
+        )
+    except Exception:
+        # Let the retried invocation claim the cooldown again and notify.
+        release_cooldown(ALERT_STATE_TABLE, station_id, status)
+        raise
 
     return {"ok": True, "notified": True, "station_id": station_id, "owner_id": owner_id}
@@ -0,0 +1,102 @@
+import os
+import types
+from functools import lru_cache
+
+import pytest
+
+from tests.helpers import fast_patch, load_lambda_module, make_table
+
+
+@pytest.fixture(scope="session", autouse=True)
+def fast_password_hashing():
+    # PBKDF2 cost is read per call; production iteration counts only slow the suite down.
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("PASSWORD_HASH_ITERATIONS", "1")
+        mp.setenv("PASSWORD_SCRYPT_N", "16")
+        yield
+
+
+@pytest.fixture
+def dynamo_fake():
+    # One InMemoryTable per table name for the duration of a test.
+    tables = {}
+
+    def table(name, pk="station_id", sort_key=None):
+        if name not in tables:
+            tables[name] = make_table(pk, sort_key)
+        return tables[name]
+
+    return table
+
+
+@pytest.fixture(scope="session")
+def admin_mod():
+    return load_lambda_module("src/admin/lambda_function.py")
+
+
+@pytest.fixture(scope="session")
+def collector_mod():
+    return load_lambda_module("src/collector/lambda_function.py")
+
+
+@pytest.fixture(scope="session")
+def history_mod():
+    return load_lambda_module("src/history/lambda_function.py")
+
+
+@pytest.fixture(scope="session")
+def router_mod():
+    return load_lambda_module("src/router/lambda_function.py")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def cached_password_fields(admin_mod, fast_password_hashing):
+    # Hash each distinct password (under the current KDF settings) once per session.
+    original = admin_mod.create_password_fields
+    cached = lru_cache(maxsize=64)(lambda password, *settings: original(password))
+
+    def create_password_fields(password):
+        settings = [os.getenv(name) for name in ("PASSWORD_HASH_ITERATIONS", "PASSWORD_HASH_DIGEST", "PASSWORD_SCRYPT_N")]
+        return dict(cached(password, *settings))
+
+    admin_mod.create_password_fields = create_password_fields
+    yield
+    admin_mod.create_password_fields = original
+
+
+@pytest.fixture
+def collector_env(collector_mod, monkeypatch):
+    # Common lambda_handler wiring: one tracked station, no AWS calls.
+    monkeypatch.setenv("METARS_TABLE", "metars")
+    monkeypatch.setenv("RUNS_TABLE", "runs")
+    monkeypatch.setenv("ROUTER_EVENT_BUS", "default")
+    monkeypatch.setenv("STALE_THRESHOLD_HOURS", "2")
+    env = types.SimpleNamespace(writes={}, events=[])
+
+    def run(metars, alert_on_empty="true"):
+        monkeypatch.setenv("ALERT_ON_EMPTY", alert_on_empty)
+        collector_mod.handler_settings.cache_clear()
+        # monkeypatch keeps the stub for follow-up warm calls and restores it at teardown.
+        monkeypatch.setattr(collector_mod, "fetch_metars", lambda url: metars)
+        return collector_mod.lambda_handler({}, None)
+
+    env.run = run
+    with fast_patch(
+        collector_mod,
+        utc_now_iso=lambda: "2026-02-20T10:00:00+00:00",
+        get_station_configs=lambda: [
+            {
+                "station_id": "KJWY",
+                "owner_id": "owner-1",
+                "notify_on": "both",
+                "cooldown_minutes": 60,
+                "alerts_enabled": True,
+            }
+        ],
+        build_url=lambda station_ids: "https://example.com",
+        write_metars=lambda **kwargs: None,
+        write_run=lambda **kwargs: env.writes.update(kwargs),
+        publish_station_alert_events=lambda station_events, event_bus_name: env.events.extend(station_events),
+    ):
+        yield env
+    collector_mod.handler_settings.cache_clear()
@@ -1,23 +1,109 @@
+import contextlib
 import importlib.util
 import os
 import pathlib
 import sys
 import types
-import uuid
+from unittest import mock
 
 
-def ensure_boto3_stubs() -> None:
+class StubResource:
+    def __init__(self, service_name: str):
+        self.meta = types.SimpleNamespace(client=mock.MagicMock(name=f"{service_name}-client"))
+
+    def Table(self, name):
+        return mock.MagicMock(name=f"Table({name})")
+
+
+# Test doubles are plain duck-typed objects: a SimpleNamespace for one-method
+# fakes, e.g. SimpleNamespace(put_item=lambda Item: captured.append(Item)), or
+# InMemoryTable below. Autospecced mocks are slow to build; test_no_autospec
+# keeps them out of the suite.
+class InMemoryTable:
+    # Dict-backed stand-in for a DynamoDB Table resource; keep tests off any
+    # network-backed fake.
+    def __init__(self, pk: str, sort_key: str | None = None):
+        self.pk = pk
+        self.sort_key = sort_key
+        self._items: dict = {}
+
+    def _key(self, item: dict) -> tuple:
+        if self.sort_key:
+            return (item[self.pk], item[self.sort_key])
+        return (item[self.pk],)
+
+    @property
+    def items(self) -> list[dict]:
+        return list(self._items.values())
+
+    def put_item(self, Item, ConditionExpression=None, **kwargs):
+        key = self._key(Item)
+        if ConditionExpression and ConditionExpression.startswith("attribute_not_exists") and key in self._items:
+            from botocore.exceptions import ClientError
+
+            raise ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem")
+        self._items[key] = Item
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        item = self._items.get(self._key(Key))
+        return {"Item": item} if item else {}
+
+    def delete_item(self, Key, **kwargs):
+        self._items.pop(self._key(Key), None)
+        return {}
+
+    def scan(self, Limit=None, **kwargs):
+        items = self.items
+        return {"Items": items[:Limit] if Limit else items}
+
+
+def make_table(pk: str = "station_id", sort_key: str | None = None) -> InMemoryTable:
+    return InMemoryTable(pk, sort_key)
+
+
+@contextlib.contextmanager
+def fast_patch(obj, **attrs):
+    # Plain attribute swap for hot test doubles; skips monkeypatch's per-call
+    # bookkeeping and restores the originals on exit.
+    old = {name: getattr(obj, name) for name in attrs}
+    for name, value in attrs.items():
+        setattr(obj, name, value)
     try:
+        yield obj
+    finally:
+        for name, value in old.items():
+            setattr(obj, name, value)
+
+
+def ensure_boto3_stubs() -> None:
+    # The unit tests never talk to AWS, so skip loading botocore's service
+    # models unless USE_REAL_BOTO3=1 asks for the real SDK.
+    if "boto3" in sys.modules:
+        return
+    if os.getenv("USE_REAL_BOTO3") == "1":
         import boto3  # noqa: F401
+
         return
-    except ModuleNotFoundError:
-        pass
 
     boto3_mod = types.ModuleType("boto3")
-    boto3_mod.resource = lambda *args, **kwargs: None
-    boto3_mod.client = lambda *args, **kwargs: None
+    boto3_mod.resource = lambda service_name, *args, **kwargs: StubResource(service_name)
+    boto3_mod.client = lambda service_name, *args, **kwargs: mock.MagicMock(name=service_name)
     sys.modules["boto3"] = boto3_mod
 
+    session_mod = types.ModuleType("boto3.session")
+
+    class Session:
+        def resource(self, service_name, *args, **kwargs):
+            return boto3_mod.resource(service_name, *args, **kwargs)
+
+        def client(self, service_name, *args, **kwargs):
+            return boto3_mod.client(service_name, *args, **kwargs)
+
+    session_mod.Session = Session
+    boto3_mod.session = session_mod
+    sys.modules["boto3.session"] = session_mod
+
     conditions_mod = types.ModuleType("boto3.dynamodb.conditions")
 
     class Attr:
@@ -37,20 +123,57 @@ def ensure_boto3_stubs() -> None:
     conditions_mod.Attr = Attr
     conditions_mod.Key = Key
 
-    sys.modules["boto3.dynamodb"] = types.ModuleType("boto3.dynamodb")
+    dynamodb_mod = types.ModuleType("boto3.dynamodb")
+    dynamodb_mod.conditions = conditions_mod
+    boto3_mod.dynamodb = dynamodb_mod
+    sys.modules["boto3.dynamodb"] = dynamodb_mod
     sys.modules["boto3.dynamodb.conditions"] = conditions_mod
 
+    config_mod = types.ModuleType("botocore.config")
+
+    class Config:
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+
+    config_mod.Config = Config
+
+    exceptions_mod = types.ModuleType("botocore.exceptions")
+
+    class ClientError(Exception):
+        def __init__(self, error_response, operation_name):
+            super().__init__(error_response.get("Error", {}).get("Message", ""))
+            self.response = error_response
+            self.operation_name = operation_name
+
+    exceptions_mod.ClientError = ClientError
+
+    botocore_mod = types.ModuleType("botocore")
+    botocore_mod.config = config_mod
+    botocore_mod.exceptions = exceptions_mod
+    sys.modules["botocore"] = botocore_mod
+    sys.modules["botocore.config"] = config_mod
+    sys.modules["botocore.exceptions"] = exceptions_mod
+
 
 def load_lambda_module(relative_path: str):
+    # Each Lambda is compiled and executed once per test session; monkeypatch
+    # still restores any attributes a test changes on the shared module.
     ensure_boto3_stubs()
     os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
     os.environ.setdefault("AWS_REGION", "us-east-1")
     os.environ.setdefault("AWS_EC2_METADATA_DISABLED", "true")
     repo_root = pathlib.Path(__file__).resolve().parents[1]
     full_path = repo_root / relative_path
-    module_name = f"testmod_{full_path.stem}_{uuid.uuid4().hex}"
+    module_name = f"testmod_{full_path.parent.name}_{full_path.stem}"
+    if module_name in sys.modules:
+        return sys.modules[module_name]
     spec = importlib.util.spec_from_file_location(module_name, full_path)
     module = importlib.util.module_from_spec(spec)
     assert spec is not None and spec.loader is not None
-    spec.loader.exec_module(module)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
     return module
@@ -1,82 +1,266 @@
 import json
+from decimal import Decimal
 
-from tests.helpers import load_lambda_module
+import pytest
 
+_LOGIN_BODY = json.dumps({"action": "login", "username": "a", "password": "b"})
 
-def test_password_hash_and_verify():
-    admin = load_lambda_module("src/admin/lambda_function.py")
-    fields = admin.create_password_fields("SuperSecurePass1!")
-    assert admin.verify_password("SuperSecurePass1!", fields) is True
-    assert admin.verify_password("wrong", fields) is False
 
-
-def test_session_token_roundtrip(monkeypatch):
-    admin = load_lambda_module("src/admin/lambda_function.py")
+@pytest.fixture
+def session_secret(admin_mod, monkeypatch):
+    # token_secret/token_hmac are cached per container; reset them around the env change.
     monkeypatch.setenv("ADMIN_SESSION_SECRET", "test-secret")
-    token, _ = admin.new_session_token("alice", ttl_minutes=5)
-    assert admin.verify_session_token(token) == "alice"
+    admin_mod.token_secret.cache_clear()
+    admin_mod.token_hmac.cache_clear()
+    yield
+    admin_mod.token_secret.cache_clear()
+    admin_mod.token_hmac.cache_clear()
 
 
-def test_bootstrap_then_login(monkeypatch):
-    admin = load_lambda_module("src/admin/lambda_function.py")
-    monkeypatch.setenv("ADMIN_SESSION_SECRET", "test-secret")
+def test_password_hash_and_verify(admin_mod):
+    fields = admin_mod.create_password_fields("SuperSecurePass1!")
+    assert admin_mod.verify_password("SuperSecurePass1!", fields) is True
+    assert admin_mod.verify_password("wrong", fields) is False
 
-    class FakeAdmins:
-        def __init__(self):
-            self.items = {}
 
-        def scan(self, **kwargs):
-            if self.items:
-                return {"Items": [{"username": next(iter(self.items.keys()))}]}
-            return {"Items": []}
+def test_verify_password_accepts_legacy_sha256_records(admin_mod):
+    salt_hex = "00" * 16
+    legacy = {
+        "password_salt": salt_hex,
+        "password_iterations": 1000,
+        "password_hash": admin_mod.password_hash("SuperSecurePass1!", salt_hex, 1000),
+    }
+    assert admin_mod.verify_password("SuperSecurePass1!", legacy) is True
 
-        def put_item(self, Item):
-            self.items[Item["username"]] = Item
 
-        def get_item(self, Key):
-            item = self.items.get(Key["username"])
-            return {"Item": item} if item else {}
+def test_scrypt_password_fields_verify(admin_mod, monkeypatch):
+    monkeypatch.setenv("PASSWORD_HASH_DIGEST", "scrypt")
+    fields = admin_mod.create_password_fields("SuperSecurePass1!")
+    assert fields["password_digest"] == "scrypt"
+    assert fields["password_iterations"] == 16
+    assert admin_mod.verify_password("SuperSecurePass1!", fields) is True
+    assert admin_mod.verify_password("wrong", fields) is False
+    assert admin_mod.verify_password("SuperSecurePass1!", {**fields, "password_iterations": 2**30}) is False
+    assert admin_mod.verify_password("SuperSecurePass1!", {**fields, "password_iterations": 24}) is False
+
 
-    fake = FakeAdmins()
-    monkeypatch.setattr(admin, "admins_table", lambda: fake)
+def test_session_token_roundtrip(admin_mod, session_secret):
+    assert admin_mod.token_secret() == b"test-secret"
+    token, _ = admin_mod.new_session_token("alice", ttl_minutes=5)
+    assert admin_mod.verify_session_token(token) == "alice"
 
-    bootstrap = admin.bootstrap_admin({"username": "admin", "password": "StrongPass123!"})
+
+def test_bootstrap_then_login(admin_mod, dynamo_fake, monkeypatch, session_secret):
+    fake = dynamo_fake("admins", pk="username")
+    monkeypatch.setattr(admin_mod, "admins_table", lambda: fake)
+
+    bootstrap = admin_mod.bootstrap_admin({"username": "admin", "password": "StrongPass123!"})
     assert bootstrap["ok"] is True
-    login = admin.login({"username": "admin", "password": "StrongPass123!"})
+    login = admin_mod.login({"username": "admin", "password": "StrongPass123!"})
     assert login["ok"] is True
-    assert "token" in login
+    assert admin_mod.verify_session_token(login["token"]) == "admin"
+    assert admin_mod.is_bootstrapped() is True
+    assert admin_mod.bootstrap_admin({"username": "other", "password": "StrongPass123!"})["error"]
+    assert admin_mod.login({"username": admin_mod.BOOTSTRAP_SENTINEL, "password": "x"})["error"] == "invalid credentials"
+
+
+def test_bootstrap_refuses_legacy_table_without_sentinel(admin_mod, dynamo_fake, monkeypatch):
+    fake = dynamo_fake("admins", pk="username")
+    fake.put_item(Item={"username": "realadmin", **admin_mod.create_password_fields("StrongPass123!")})
+    monkeypatch.setattr(admin_mod, "admins_table", lambda: fake)
+
+    result = admin_mod.bootstrap_admin({"username": "attacker", "password": "StrongPass123!"})
+
+    assert result == {"error": "admin user already exists"}
+    assert fake.get_item(Key={"username": "attacker"}) == {}
+    assert fake.get_item(Key={"username": admin_mod.BOOTSTRAP_SENTINEL})["Item"]
 
 
-def test_add_station_rejects_invalid_notify_on():
-    admin = load_lambda_module("src/admin/lambda_function.py")
-    result = admin.add_station({"station_id": "KJWY", "notify_on": "bad"})
+def test_bootstrap_rejects_sentinel_username(admin_mod, dynamo_fake, monkeypatch):
+    fake = dynamo_fake("admins", pk="username")
+    monkeypatch.setattr(admin_mod, "admins_table", lambda: fake)
+
+    result = admin_mod.bootstrap_admin({"username": admin_mod.BOOTSTRAP_SENTINEL, "password": "StrongPass123!"})
+
+    assert result == {"error": "username is reserved"}
+    assert fake.items == []
+    assert admin_mod.bootstrap_admin({"username": "admin", "password": "StrongPass123!"})["ok"] is True
+
+
+def test_rejected_bootstrap_and_reset_skip_password_hashing(admin_mod, dynamo_fake, monkeypatch):
+    fake = dynamo_fake("admins", pk="username")
+    fake.put_item(Item={"username": admin_mod.BOOTSTRAP_SENTINEL})
+    monkeypatch.setattr(admin_mod, "admins_table", lambda: fake)
+    hashed = []
+    monkeypatch.setattr(admin_mod, "create_password_fields", lambda password: hashed.append(password))
+
+    assert admin_mod.bootstrap_admin({"username": "attacker", "password": "StrongPass123!"})["error"]
+    result = admin_mod.confirm_password_reset(
+        {"username": "nobody", "reset_code": "123456", "new_password": "StrongPass123!"}
+    )
+    assert result == {"error": "unknown username"}
+    assert hashed == []
+
+
+def test_add_station_rejects_invalid_notify_on(admin_mod):
+    result = admin_mod.add_station({"station_id": "KJWY", "notify_on": "bad"})
     assert result["error"] == "notify_on must be error|empty|both"
 
 
-def test_public_login_action_does_not_require_bearer(monkeypatch):
-    admin = load_lambda_module("src/admin/lambda_function.py")
-    monkeypatch.setattr(admin, "login", lambda body: {"ok": True, "token": "abc", "expires_at_epoch": 123})
+def test_add_station_upserts_with_normalized_values(admin_mod, dynamo_fake, monkeypatch):
+    fake = dynamo_fake("stations")
+    monkeypatch.setattr(admin_mod, "stations_table", lambda: fake)
+
+    result = admin_mod.add_station({"station_id": " kjwy ", "owner_id": None, "notify_on": "ERROR"})
+    assert result["ok"] is True
+    assert fake.items == [
+        {
+            "station_id": "KJWY",
+            "enabled": True,
+            "owner_id": "",
+            "notify_on": "error",
+            "cooldown_minutes": 60,
+            "alerts_enabled": True,
+            "enabled_flag": "1",
+        }
+    ]
+
+
+def test_public_login_action_does_not_require_bearer(admin_mod, monkeypatch):
+    monkeypatch.setattr(admin_mod, "login", lambda body: {"ok": True, "token": "abc", "expires_at_epoch": 123})
     event = {
         "requestContext": {"http": {"method": "POST"}},
         "queryStringParameters": {},
         "pathParameters": {},
         "headers": {},
-        "body": json.dumps({"action": "login", "username": "a", "password": "b"}),
+        "body": _LOGIN_BODY,
     }
-    result = admin.lambda_handler(event, None)
+    result = admin_mod.lambda_handler(event, None)
     assert result["statusCode"] == 200
 
 
-def test_auth_status_endpoint_is_public(monkeypatch):
-    admin = load_lambda_module("src/admin/lambda_function.py")
-    monkeypatch.setattr(admin, "is_bootstrapped", lambda: True)
+def test_auth_status_endpoint_is_public(admin_mod, monkeypatch):
+    monkeypatch.setattr(admin_mod, "is_bootstrapped", lambda: True)
     event = {
         "requestContext": {"http": {"method": "GET"}},
         "queryStringParameters": {"type": "auth"},
         "pathParameters": {},
         "headers": {},
     }
-    result = admin.lambda_handler(event, None)
+    result = admin_mod.lambda_handler(event, None)
     assert result["statusCode"] == 200
     body = json.loads(result["body"])
     assert body["bootstrapped"] is True
+
+
+def test_list_stations_paginates_and_caches(admin_mod, monkeypatch):
+    pages = [
+        {"Items": [{"station_id": "KSFO"}], "LastEvaluatedKey": {"station_id": "KSFO"}},
+        {"Items": [{"station_id": "KJWY"}]},
+    ]
+    calls = []
+
+    class FakeStations:
+        def scan(self, **kwargs):
+            calls.append(kwargs)
+            return pages[len(calls) - 1]
+
+    monkeypatch.setattr(admin_mod, "_list_cache", {})
+    monkeypatch.setattr(admin_mod, "stations_table", lambda: FakeStations())
+
+    assert [i["station_id"] for i in admin_mod.list_stations()] == ["KJWY", "KSFO"]
+    assert calls[1]["ExclusiveStartKey"] == {"station_id": "KSFO"}
+    assert "ProjectionExpression" in calls[0]
+    admin_mod.list_stations()
+    assert len(calls) == 2
+
+
+def test_confirm_password_reset_checks_code(admin_mod, monkeypatch):
+    salt_hex = "ab" * 16
+    item = {
+        "username": "admin",
+        "reset_salt": salt_hex,
+        "reset_hash": admin_mod.hash_short_code("123456", salt_hex),
+        "reset_expires_epoch": admin_mod.now_epoch() + 60,
+    }
+    updates = []
+
+    class FakeAdmins:
+        def get_item(self, Key):
+            return {"Item": item}
+
+        def update_item(self, **kwargs):
+            updates.append(kwargs)
+
+    monkeypatch.setattr(admin_mod, "admins_table", lambda: FakeAdmins())
+    body = {"username": "admin", "new_password": "AnotherPass123!"}
+
+    assert admin_mod.confirm_password_reset({**body, "reset_code": "654321"}) == {"error": "invalid reset code"}
+    assert updates == []
+    assert admin_mod.confirm_password_reset({**body, "reset_code": "123456"})["ok"] is True
+    assert len(updates) == 1
+    assert updates[0]["ExpressionAttributeValues"][":rh"] == item["reset_hash"]
+    assert "ConditionExpression" in updates[0]
+
+
+def test_verify_session_token_rejects_tampered_signature(admin_mod):
+    token, _ = admin_mod.new_session_token("alice", ttl_minutes=5)
+    payload_part, sig_part = token.split(".", 1)
+    flipped = "A" if sig_part[0] != "A" else "B"
+    assert admin_mod.verify_session_token(f"{payload_part}.{flipped}{sig_part[1:]}") == ""
+    undecodable = "A" * 41 + "**"
+    assert len(undecodable) == admin_mod.TOKEN_SIG_LENGTH
+    assert admin_mod.verify_session_token(f"{payload_part}.{undecodable}") == ""
+    assert admin_mod.verify_session_token(f"{payload_part}.short") == ""
+    assert admin_mod.verify_session_token(f"{payload_part}.{sig_part}x") == ""
+    assert admin_mod.verify_session_token(f"{'a' * 600}.{sig_part}") == ""
+
+
+def test_response_serializes_decimals(admin_mod):
+    result = admin_mod.response(200, {"items": [{"cooldown_minutes": Decimal("60"), "ratio": Decimal("0.5")}]})
+    assert json.loads(result["body"]) == {"items": [{"cooldown_minutes": 60, "ratio": 0.5}]}
+
+
+def test_require_auth_accepts_mixed_case_authorization_header(admin_mod):
+    token, _ = admin_mod.new_session_token("alice", ttl_minutes=5)
+    headers = admin_mod.normalize_headers({"headers": {"Authorization": f"Bearer {token}"}})
+    assert admin_mod.require_auth(headers) == "alice"
+    assert admin_mod.require_auth(admin_mod.normalize_headers({})) == ""
+
+
+@pytest.mark.parametrize(
+    ("headers", "expected"),
+    [
+        ({"authorization": "Bearer abc.def"}, "abc.def"),
+        ({"authorization": "bearer abc.def"}, "abc.def"),
+        ({"authorization": "BEARER  abc.def "}, "abc.def"),
+        ({"authorization": "Basic abc"}, ""),
+        ({}, ""),
+    ],
+)
+def test_parse_bearer_token_accepts_scheme_case_variants(admin_mod, headers, expected):
+    assert admin_mod.parse_bearer_token(headers) == expected
+
+
+def test_verify_session_token_caches_briefly(admin_mod, monkeypatch):
+    token, exp = admin_mod.new_session_token("alice", ttl_minutes=5, now=1_000)
+    monkeypatch.setattr(admin_mod, "now_epoch", lambda: 1_000)
+    monkeypatch.setattr(admin_mod, "_verify_cache", {})
+    decoded = []
+    real_decode = admin_mod.decode_session_token
+    monkeypatch.setattr(admin_mod, "decode_session_token", lambda t: decoded.append(t) or real_decode(t))
+
+    monkeypatch.setenv("ADMIN_VERIFY_CACHE_TTL", "5")
+    assert admin_mod.verify_session_token(token) == "alice"
+    assert admin_mod.verify_session_token(token) == "alice"
+    assert len(decoded) == 1
+    assert admin_mod._verify_cache[token] == ("alice", 1_005)
+
+    monkeypatch.setattr(admin_mod, "now_epoch", lambda: exp)
+    assert admin_mod.verify_session_token(token) == ""
+
+    monkeypatch.setenv("ADMIN_VERIFY_CACHE_TTL", "0")
+    monkeypatch.setattr(admin_mod, "now_epoch", lambda: 1_000)
+    admin_mod.verify_session_token(token)
+    admin_mod.verify_session_token(token)
+    assert len(decoded) == 4
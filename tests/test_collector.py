@@ -1,112 +1,240 @@
+import io
 import json
+import math
+from types import SimpleNamespace
 
-from tests.helpers import load_lambda_module
+import pytest
 
+from tests.helpers import fast_patch
 
-def test_filter_alert_events_drops_empty_when_disabled():
-    collector = load_lambda_module("src/collector/lambda_function.py")
+
+@pytest.mark.parametrize(
+    ("alert_on_empty", "expected"),
+    [(False, ["error"]), (True, ["empty", "error"])],
+)
+def test_filter_alert_events_keeps_allowed_statuses(collector_mod, alert_on_empty, expected):
     payload = [
         {"station_id": "KJWY", "status": "empty"},
         {"station_id": "KJWY", "status": "error"},
+        {"station_id": "KJWY", "status": "ok"},
     ]
-    filtered = collector.filter_alert_events(payload, alert_on_empty=False)
-    assert filtered == [{"station_id": "KJWY", "status": "error"}]
-
-
-def test_lambda_handler_marks_stale_station_as_error(monkeypatch):
-    collector = load_lambda_module("src/collector/lambda_function.py")
+    filtered = collector_mod.filter_alert_events(payload, alert_on_empty=alert_on_empty)
+    assert [e["status"] for e in filtered] == expected
+
+
+@pytest.mark.parametrize(
+    ("metars", "alert_on_empty", "body_status", "run_status", "alert_statuses"),
+    [
+        ([{"station_id": "KJWY", "observation_time": "2026-02-20T07:30:00+00:00"}], "true", "ok", "error", ["error"]),
+        ([{"station_id": "KJWY", "observation_time": "2026-02-20T08:00:00Z"}], "true", "ok", "ok", []),
+        ([], "false", "empty", "empty", []),
+    ],
+    ids=["stale-station-is-error", "exactly-at-threshold-is-ok", "empty-result-without-empty-alert"],
+)
+def test_lambda_handler_run_status_and_alerts(
+    collector_env, metars, alert_on_empty, body_status, run_status, alert_statuses
+):
+    result = collector_env.run(metars, alert_on_empty)
+    body = json.loads(result["body"])
 
-    monkeypatch.setenv("METARS_TABLE", "metars")
-    monkeypatch.setenv("RUNS_TABLE", "runs")
-    monkeypatch.setenv("ROUTER_EVENT_BUS", "default")
-    monkeypatch.setenv("ALERT_ON_EMPTY", "true")
-    monkeypatch.setenv("STALE_THRESHOLD_HOURS", "2")
-
-    monkeypatch.setattr(collector, "utc_now_iso", lambda: "2026-02-20T10:00:00+00:00")
-    monkeypatch.setattr(
-        collector,
-        "get_station_configs",
-        lambda: [
-            {
-                "station_id": "KJWY",
-                "owner_id": "owner-1",
-                "notify_on": "both",
-                "cooldown_minutes": 60,
-                "alerts_enabled": True,
-            }
-        ],
-    )
-    monkeypatch.setattr(collector, "build_url", lambda station_ids: "https://example.com")
-    monkeypatch.setattr(collector, "fetch_xml", lambda url: "<response/>")
-    monkeypatch.setattr(
-        collector,
-        "parse_metar_xml",
-        lambda body: [
-            {
-                "station_id": "KJWY",
-                "observation_time": "2026-02-20T07:30:00+00:00",
-            }
-        ],
-    )
+    assert result["statusCode"] == 200
+    assert body["status"] == body_status
+    assert collector_env.writes["status"] == run_status
+    assert [e["status"] for e in collector_env.events] == alert_statuses
 
-    writes = {}
-    events = []
-    monkeypatch.setattr(collector, "write_metars", lambda **kwargs: None)
-    monkeypatch.setattr(collector, "write_run", lambda **kwargs: writes.update(kwargs))
-    monkeypatch.setattr(
-        collector,
-        "publish_station_alert_events",
-        lambda station_events, event_bus_name: events.extend(station_events),
-    )
 
-    result = collector.lambda_handler({}, None)
-    body = json.loads(result["body"])
+def test_lambda_handler_skips_alert_payloads_when_all_stations_ok(collector_mod, collector_env):
+    def fail(*args, **kwargs):
+        raise AssertionError("no alert payloads expected")
 
-    assert result["statusCode"] == 200
-    assert body["status"] == "ok"
-    assert writes["status"] == "error"
-    assert events and events[0]["status"] == "error"
+    with fast_patch(collector_mod, station_alert_events=fail, publish_station_alert_events=fail):
+        result = collector_env.run([{"station_id": "KJWY", "observation_time": "2026-02-20T09:30:00+00:00"}])
 
+    assert json.loads(result["body"])["stations"] == ["KJWY"]
 
-def test_lambda_handler_empty_result_without_empty_alert(monkeypatch):
-    collector = load_lambda_module("src/collector/lambda_function.py")
 
+def test_handler_settings_are_read_once_per_container(collector_mod, monkeypatch):
     monkeypatch.setenv("METARS_TABLE", "metars")
     monkeypatch.setenv("RUNS_TABLE", "runs")
-    monkeypatch.setenv("ROUTER_EVENT_BUS", "default")
     monkeypatch.setenv("ALERT_ON_EMPTY", "false")
+    collector_mod.handler_settings.cache_clear()
+    try:
+        settings = collector_mod.handler_settings()
+        monkeypatch.setenv("ALERT_ON_EMPTY", "true")
+        assert collector_mod.handler_settings() is settings
+        assert settings["alert_on_empty"] is False
+    finally:
+        collector_mod.handler_settings.cache_clear()
+
+
+@pytest.mark.parametrize(
+    "metars",
+    [[], [{"station_id": "KJWY", "observation_time": "2026-02-20T07:30:00+00:00"}]],
+    ids=["empty", "stale"],
+)
+def test_lambda_handler_reads_alert_on_empty_at_most_once(collector_mod, collector_env, monkeypatch, metars):
+    reads = []
+    real_getenv = collector_mod.os.getenv
+
+    def counting_getenv(key, default=None):
+        if key == "ALERT_ON_EMPTY":
+            reads.append(key)
+        return real_getenv(key, default)
+
+    monkeypatch.setattr(collector_mod.os, "getenv", counting_getenv)
+    # run() clears handler_settings, so this is a cold invocation.
+    collector_env.run(metars)
+    assert reads == ["ALERT_ON_EMPTY"]
+    collector_mod.lambda_handler({}, None)
+    assert reads == ["ALERT_ON_EMPTY"]
+
+
+def test_parse_metar_xml_extracts_fields_and_skips_incomplete(collector_mod):
+    xml_text = """<response><data num_results="2">
+      <METAR>
+        <raw_text>KJWY 201000Z AUTO 18005KT 10SM CLR 02/M03 A3012</raw_text>
+        <station_id>KJWY</station_id>
+        <observation_time>2026-02-20T10:00:00Z</observation_time>
+        <temp_c>2.0</temp_c>
+        <sky_condition sky_cover="CLR" />
+        <flight_category>VFR</flight_category>
+        <wind_gust_kt />
+      </METAR>
+      <METAR><station_id>KSFO</station_id></METAR>
+    </data></response>"""
+    metars = collector_mod.parse_metar_xml(io.BytesIO(xml_text.encode("utf-8")))
+    assert metars == [
+        {
+            "station_id": "KJWY",
+            "observation_time": "2026-02-20T10:00:00Z",
+            "temp_c": "2.0",
+            "dewpoint_c": None,
+            "wind_dir_degrees": None,
+            "wind_speed_kt": None,
+            "visibility_statute_mi": None,
+            "altim_in_hg": None,
+            "flight_category": "VFR",
+            "raw_text": "KJWY 201000Z AUTO 18005KT 10SM CLR 02/M03 A3012",
+        }
+    ]
 
-    monkeypatch.setattr(collector, "utc_now_iso", lambda: "2026-02-20T10:00:00+00:00")
-    monkeypatch.setattr(
-        collector,
-        "get_station_configs",
-        lambda: [
-            {
-                "station_id": "KJWY",
-                "owner_id": "owner-1",
-                "notify_on": "both",
-                "cooldown_minutes": 60,
-                "alerts_enabled": True,
-            }
-        ],
-    )
-    monkeypatch.setattr(collector, "build_url", lambda station_ids: "https://example.com")
-    monkeypatch.setattr(collector, "fetch_xml", lambda url: "<response/>")
-    monkeypatch.setattr(collector, "parse_metar_xml", lambda body: [])
-
-    writes = {}
-    published = []
-    monkeypatch.setattr(collector, "write_run", lambda **kwargs: writes.update(kwargs))
-    monkeypatch.setattr(
-        collector,
-        "publish_station_alert_events",
-        lambda station_events, event_bus_name: published.extend(station_events),
+
+def test_write_metars_sets_expiry_from_observation_time(collector_mod):
+    requests = []
+    client = SimpleNamespace(batch_write_item=lambda RequestItems: requests.append(RequestItems) or {})
+
+    with fast_patch(collector_mod, dynamodb_client=client):
+        collector_mod.write_metars(
+            metars_table_name="metars",
+            metars=[
+                {"station_id": "KJWY", "observation_time": "2026-02-20T10:00:00Z", "temp_c": "2.0"},
+                {"station_id": "KJWY", "observation_time": "not-a-date"},
+            ],
+            collected_at="2026-02-20T10:05:00+00:00",
+            retention_days=2,
+        )
+
+    written = [r["PutRequest"]["Item"] for r in requests[0]["metars"]]
+    assert written[0]["expires_at"] == {"N": str(1771581600 + 2 * 86400)}
+    assert written[0]["temp_c"] == {"S": "2.0"}
+    assert written[0]["raw_text"] == {"NULL": True}
+    assert int(written[1]["expires_at"]["N"]) > 1771581600 + 2 * 86400
+
+
+def test_write_metars_chunks_dedupes_and_retries_unprocessed(collector_mod):
+    requests = []
+
+    class FakeClient:
+        def batch_write_item(self, RequestItems):
+            requests.append(RequestItems)
+            if len(requests) == 1:
+                return {"UnprocessedItems": {"metars": RequestItems["metars"][:3]}}
+            return {"UnprocessedItems": {}}
+
+    metars = [{"station_id": "KJWY", "observation_time": f"2026-02-20T{h:02d}:00:00Z"} for h in range(24)]
+    metars += [{"station_id": f"K{i:03d}", "observation_time": "2026-02-20T10:00:00Z"} for i in range(6)]
+    metars.append(dict(metars[0]))
+
+    with fast_patch(collector_mod, dynamodb_client=FakeClient()), fast_patch(collector_mod.time, sleep=lambda s: None):
+        collector_mod.write_metars(
+            metars_table_name="metars",
+            metars=metars,
+            collected_at="2026-02-20T10:05:00+00:00",
+            retention_days=2,
+        )
+
+    assert [len(r["metars"]) for r in requests] == [25, 3, 5]
+
+
+def test_get_station_configs_scans_and_backfills_until_index_ready(collector_mod, monkeypatch):
+    monkeypatch.setenv("STATIONS_TABLE", "stations")
+
+    class FakeStations:
+        def __init__(self, indexed, scanned):
+            self.indexed = indexed
+            self.scanned = scanned
+            self.calls = []
+
+        def query(self, **kwargs):
+            self.calls.append(("query", kwargs["IndexName"]))
+            return {"Items": self.indexed}
+
+        def scan(self, **kwargs):
+            self.calls.append(("scan", None))
+            return {"Items": self.scanned}
+
+        def update_item(self, **kwargs):
+            self.calls.append(("backfill", kwargs["Key"]["station_id"]))
+            if kwargs["Key"]["station_id"] == "KDIS":
+                raise collector_mod.ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "UpdateItem")
+
+    # One station re-saved after the upgrade must not hide the legacy ones.
+    scanned = [
+        {"station_id": "ksfo", "owner_id": "o1", "enabled_flag": "1"},
+        {"station_id": "KJWY"},
+        {"station_id": "KDIS"},
+    ]
+    legacy = FakeStations([{"station_id": "ksfo", "owner_id": "o1"}], scanned)
+    monkeypatch.setattr(collector_mod, "dynamo_table", lambda name: legacy)
+    monkeypatch.setenv("STATION_INDEX_READY", "false")
+    configs = collector_mod.get_station_configs()
+    assert [c["station_id"] for c in configs] == ["KDIS", "KJWY", "KSFO"]
+    assert legacy.calls == [("scan", None), ("backfill", "KJWY"), ("backfill", "KDIS")]
+
+    indexed = FakeStations([{"station_id": "ksfo", "owner_id": "o1"}], [])
+    monkeypatch.setattr(collector_mod, "dynamo_table", lambda name: indexed)
+    monkeypatch.setenv("STATION_INDEX_READY", "true")
+    assert [c["station_id"] for c in collector_mod.get_station_configs()] == ["KSFO"]
+    assert indexed.calls == [("query", "EnabledIndex")]
+
+
+def test_encode_event_details_round_trips(collector_mod):
+    station_events = collector_mod.station_alert_events(
+        station_configs=[{"station_id": "KJWY", "owner_id": 'own"er'}, {"station_id": "KCOD"}],
+        checked_at="2026-02-20T10:00:00+00:00",
+        source_url="https://example.com/?ids=KJWY,KCOD",
+        status_by_station={"KJWY": "error"},
+        error_message="timed out",
     )
 
-    result = collector.lambda_handler({}, None)
-    body = json.loads(result["body"])
+    details = collector_mod.encode_event_details(station_events)
 
-    assert result["statusCode"] == 200
-    assert body["status"] == "empty"
-    assert writes["status"] == "empty"
-    assert published == []
+    assert [json.loads(d) for d in details] == station_events
+    assert not any('": ' in d or '", "' in d for d in details)
+
+
+@pytest.mark.parametrize("count", [1, 10, 23])
+def test_publish_station_alert_events_batches_put_events(collector_mod, count):
+    calls = []
+    client = SimpleNamespace(put_events=lambda Entries: calls.append(Entries) or {"FailedEntryCount": 0})
+    station_events = [{"station_id": f"K{i:03d}", "status": "error"} for i in range(count)]
+
+    with fast_patch(collector_mod, events=client):
+        collector_mod.publish_station_alert_events(station_events, event_bus_name="default")
+
+    assert len(calls) == math.ceil(count / collector_mod.EVENTS_BATCH_SIZE)
+    assert all(len(entries) <= 10 for entries in calls)
+    assert [json.loads(e["Detail"])["station_id"] for entries in calls for e in entries] == [
+        e["station_id"] for e in station_events
+    ]
+    assert calls[0][0]["EventBusName"] == "default"
@@ -0,0 +1,22 @@
+import pathlib
+import re
+
+from tests.helpers import InMemoryTable
+
+
+def test_no_autospec():
+    tests_dir = pathlib.Path(__file__).resolve().parent
+    offenders = [
+        path.name
+        for path in tests_dir.glob("*.py")
+        if re.search(r"autospec\s*=|create_autospec\(", path.read_text(encoding="utf-8"))
+    ]
+    assert offenders == []
+
+
+def test_in_memory_table_round_trip():
+    table = InMemoryTable("station_id", sort_key="alert_type")
+    table.put_item(Item={"station_id": "KJWY", "alert_type": "error", "n": 1})
+    assert table.get_item(Key={"station_id": "KJWY", "alert_type": "error"})["Item"]["n"] == 1
+    table.delete_item(Key={"station_id": "KJWY", "alert_type": "error"})
+    assert table.get_item(Key={"station_id": "KJWY", "alert_type": "error"}) == {}
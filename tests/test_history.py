@@ -1,17 +1,20 @@
-from tests.helpers import load_lambda_module
+from decimal import Decimal
 
+import pytest
 
-def test_parse_limit_defaults_and_clamps():
-    history = load_lambda_module("src/history/lambda_function.py")
-    assert history.parse_limit(None, 168) == 168
-    assert history.parse_limit("bad", 168) == 168
-    assert history.parse_limit("0", 168) == 1
-    assert history.parse_limit("1000", 168) == 500
 
+@pytest.mark.parametrize(("value", "expected"), [(None, 168), ("bad", 168), ("0", 1), ("1000", 500)])
+def test_parse_limit_defaults_and_clamps(history_mod, value, expected):
+    assert history_mod.parse_limit(value, 168) == expected
 
-def test_options_returns_cors_headers():
-    history = load_lambda_module("src/history/lambda_function.py")
+
+def test_options_returns_cors_headers(history_mod):
     event = {"requestContext": {"http": {"method": "OPTIONS"}}}
-    result = history.lambda_handler(event, None)
+    result = history_mod.lambda_handler(event, None)
     assert result["statusCode"] == 200
     assert "Access-Control-Allow-Origin" in result["headers"]
+
+
+def test_response_serializes_decimals_compactly(history_mod):
+    result = history_mod.response(200, {"items": [{"metar_count": Decimal("3"), "temp_c": Decimal("-1.5")}]})
+    assert result["body"] == '{"items":[{"metar_count":3,"temp_c":-1.5}]}'
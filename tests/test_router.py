@@ -1,24 +1,93 @@
-from tests.helpers import load_lambda_module
+import pytest
 
 
-def test_parse_notify_on_defaults_to_both():
-    router = load_lambda_module("src/router/lambda_function.py")
-    assert router.parse_notify_on("error") == "error"
-    assert router.parse_notify_on("empty") == "empty"
-    assert router.parse_notify_on("bad-value") == "both"
+@pytest.mark.parametrize(("value", "expected"), [("error", "error"), ("empty", "empty"), ("bad-value", "both")])
+def test_parse_notify_on_defaults_to_both(router_mod, value, expected):
+    assert router_mod.parse_notify_on(value) == expected
 
 
-def test_should_notify_policy():
-    router = load_lambda_module("src/router/lambda_function.py")
-    assert router.should_notify("error", "both") is True
-    assert router.should_notify("empty", "both") is True
-    assert router.should_notify("error", "error") is True
-    assert router.should_notify("empty", "error") is False
-    assert router.should_notify("ok", "both") is False
+@pytest.mark.parametrize(
+    ("status", "notify_on", "expected"),
+    [
+        ("error", "both", True),
+        ("empty", "both", True),
+        ("error", "error", True),
+        ("empty", "error", False),
+        ("ok", "both", False),
+    ],
+)
+def test_should_notify_policy(router_mod, status, notify_on, expected):
+    assert router_mod.should_notify(status, notify_on) is expected
 
 
-def test_lambda_handler_skips_invalid_event():
-    router = load_lambda_module("src/router/lambda_function.py")
-    result = router.lambda_handler({"detail": {"status": "ok", "station_id": "KJWY"}}, None)
+def test_lambda_handler_skips_invalid_event(router_mod):
+    result = router_mod.lambda_handler({"detail": {"status": "ok", "station_id": "KJWY"}}, None)
     assert result["ok"] is True
     assert result["skipped"] == "invalid-event"
+
+
+def test_lambda_handler_notifies_owner_outside_cooldown(router_mod, monkeypatch):
+    station = {"station_id": "KJWY", "owner_id": "owner-1", "notify_on": "both", "cooldown_minutes": 30}
+    owner = {"owner_id": "owner-1", "topic_arn": "arn:aws:sns:us-east-1:123:owner-1"}
+    published = []
+    cooldowns = []
+    monkeypatch.setattr(router_mod, "get_station", lambda table_name, station_id: station)
+    monkeypatch.setattr(router_mod, "get_owner", lambda table_name, owner_id: owner)
+    monkeypatch.setattr(router_mod, "claim_cooldown", lambda *args: cooldowns.append(args) or True)
+    monkeypatch.setattr(router_mod, "publish_owner_topic", lambda *args: published.append(args))
+
+    result = router_mod.lambda_handler({"detail": {"status": "error", "station_id": "kjwy"}}, None)
+
+    assert result == {"ok": True, "notified": True, "station_id": "KJWY", "owner_id": "owner-1"}
+    assert published[0][0] == owner["topic_arn"]
+    assert cooldowns == [(router_mod.ALERT_STATE_TABLE, "KJWY", "error", 30)]
+
+
+def test_claim_cooldown_is_a_single_conditional_put(router_mod, monkeypatch):
+    clock = [10_000]
+    monkeypatch.setattr(router_mod, "now_epoch", lambda: clock[0])
+    puts = []
+    stored = {}
+
+    class FakeTable:
+        def put_item(self, **kwargs):
+            puts.append(kwargs)
+            last = stored.get("last_notified_epoch")
+            # Mirrors COOLDOWN_CONDITION_EXPRESSION, pinned below.
+            if last is not None and not last <= kwargs["ExpressionAttributeValues"][":cutoff"]:
+                raise router_mod.ClientError({"Error": {"Code": "ConditionalCheckFailedException"}}, "PutItem")
+            stored.update(kwargs["Item"])
+
+    monkeypatch.setattr(router_mod, "dynamo_table", lambda name: FakeTable())
+
+    assert router_mod.COOLDOWN_CONDITION_EXPRESSION.endswith("last_notified_epoch <= :cutoff")
+    assert router_mod.claim_cooldown("alert-state", "KJWY", "error", 30) is True
+    assert router_mod.claim_cooldown("alert-state", "KJWY", "error", 30) is False
+    assert puts[0]["ConditionExpression"] == router_mod.COOLDOWN_CONDITION_EXPRESSION
+    assert puts[0]["ExpressionAttributeValues"] == {":cutoff": 10_000 - 30 * 60}
+    assert puts[0]["Item"]["last_notified_epoch"] == 10_000
+
+    clock[0] = 10_000 + 30 * 60 - 1
+    assert router_mod.claim_cooldown("alert-state", "KJWY", "error", 30) is False
+    clock[0] = 10_000 + 30 * 60
+    assert router_mod.claim_cooldown("alert-state", "KJWY", "error", 30) is True
+    assert stored["last_notified_epoch"] == 10_000 + 30 * 60
+
+
+def test_lambda_handler_releases_cooldown_when_publish_fails(router_mod, monkeypatch):
+    station = {"station_id": "KJWY", "owner_id": "owner-1"}
+    owner = {"owner_id": "owner-1", "topic_arn": "arn:aws:sns:us-east-1:123:owner-1"}
+    released = []
+    monkeypatch.setattr(router_mod, "get_station", lambda table_name, station_id: station)
+    monkeypatch.setattr(router_mod, "get_owner", lambda table_name, owner_id: owner)
+    monkeypatch.setattr(router_mod, "claim_cooldown", lambda *args: True)
+    monkeypatch.setattr(router_mod, "release_cooldown", lambda *args: released.append(args))
+
+    def publish(*args):
+        raise RuntimeError("sns down")
+
+    monkeypatch.setattr(router_mod, "publish_owner_topic", publish)
+
+    with pytest.raises(RuntimeError):
+        router_mod.lambda_handler({"detail": {"status": "empty", "station_id": "KJWY"}}, None)
+    assert released == [(router_mod.ALERT_STATE_TABLE, "KJWY", "empty")]
@@ -40,6 +40,12 @@ variable "alert_on_empty" {
   default     = true
 }
 
+variable "station_index_ready" {
+  type        = bool
+  description = "Read enabled stations from the EnabledIndex GSI; leave false until the collector logs an enabled_flag backfill of 0"
+  default     = false
+}
+
 variable "alert_email" {
   type        = string
   description = "Optional email for SNS alerts (must confirm subscription)"